@@ -0,0 +1,30 @@
+"""batching.py - Splits batches of writes into cross-group transactions.
+Free of App Engine imports so that it can be tested in any Python
+process."""
+
+
+def chunk_by_groups(items, owner_of, max_groups, shared_groups=0):
+    """Splits items into lists that each fit in one cross-group
+    transaction. Every item is its own entity group and is written along
+    with its owner's, e.g. a Game and its User.
+    Args:
+        items: The items, in order
+        owner_of: Returns the owner of an item; owners are hashable
+        max_groups: The most entity groups one transaction may span
+        shared_groups: Groups every transaction also writes, such as a
+            points shard
+    Returns:
+        A list of lists of items, in order."""
+    chunks = []
+    chunk, owners = [], set()
+    for item in items:
+        owner = owner_of(item)
+        groups = (len(chunk) + 1 + len(owners | {owner}) + shared_groups)
+        if chunk and groups > max_groups:
+            chunks.append(chunk)
+            chunk, owners = [], set()
+        chunk.append(item)
+        owners.add(owner)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
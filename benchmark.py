@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+"""benchmark.py - Local load test for the WhoSaysApi endpoints and the
+main.py task and cron handlers.
+
+Runs everything in-process against the App Engine testbed's in-memory
+datastore, memcache, task queue and mail stubs. The datastore is seeded
+with the requested number of Users, GameData and Games, then each scenario
+is run repeatedly and its throughput, latency percentiles and API calls
+per request are reported. Tasks enqueued by a request are run after it,
+outside its timing, and reported under their own URLs.
+
+Usage:
+    python benchmark.py --sdk ~/google-cloud-sdk/platform/google_appengine
+    python benchmark.py --sdk ... --users 2000 --games 20000 get_high_scores
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+import urlparse
+
+
+def setup_sdk(sdk_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def activate_testbed():
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id='whosays-benchmark')
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=os.path.dirname(os.path.abspath(
+        __file__)))
+    bed.init_mail_stub()
+    bed.init_app_identity_stub()
+    # Imported once the testbed's API proxy is in place, since the
+    # instrumentation hooks are registered on the active proxy.
+    import instrumentation
+    instrumentation.install_hooks()
+    return bed
+
+
+class Stats(object):
+    """Latencies and API call counts for one scenario or task URL."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.rpcs = collections.Counter()
+
+    def add(self, seconds, rpcs, error=False):
+        self.latencies.append(seconds)
+        self.rpcs.update(rpcs)
+        if error:
+            self.errors += 1
+
+    def percentile(self, p):
+        import instrumentation
+        return instrumentation.percentile(self.latencies, p)
+
+
+def seed(num_users, num_game_data, num_games):
+    """Writes the benchmark data set. Returns a dict of the seeded user
+    names and game keys for the scenarios to draw from."""
+    from google.appengine.ext import ndb
+    from game_rules import MAX_HINTS, points_for
+    from models import User, GameData, Game, SayerCategory
+
+    categories = [category.name for category in SayerCategory]
+    users = [User(id='user{}'.format(i), name='user{}'.format(i),
+                  email='user{}@example.com'.format(i))
+             for i in range(num_users)]
+    ndb.put_multi(users)
+
+    game_data = [GameData(sayer_category=categories[i % len(categories)],
+                          sayer='Sayer {}'.format(i),
+                          saying='Saying number {}'.format(i),
+                          hints=['19{:02d}'.format(i % 100), 'Genre',
+                                 'Female', 'Medium', 'SI'])
+                 for i in range(num_game_data)]
+    ndb.put_multi(game_data)
+
+    games = []
+    for i in range(num_games):
+        data = game_data[i % len(game_data)]
+        num_hints = random.randint(0, MAX_HINTS)
+        games.append(Game(user=random.choice(users).key,
+                          sayer_category=data.sayer_category,
+                          who_says=data.sayer,
+                          saying=data.saying,
+                          num_hints=num_hints,
+                          points=points_for(num_hints),
+                          hints=[],
+                          game_data=data.key,
+                          status=random.choice(
+                              ['NEW', 'WON', 'WON', 'LOST', 'CANCELLED'])))
+    ndb.put_multi(games)
+    return {'user_names': [user.name for user in users],
+            'game_keys': [game.key.urlsafe() for game in games]}
+
+
+def scenarios():
+    """Returns name -> prepare(state) functions. Each prepare function does
+    any per-iteration setup outside the timing and returns the callable
+    that is timed."""
+    import main
+    import whosays_api as api
+    from protorpc import message_types
+    from models import Game, SayerCategory, User
+
+    service = api.WhoSaysApi()
+
+    def user_name(state):
+        return random.choice(state['user_names'])
+
+    def make_move(state):
+        user = User.get_by_name(user_name(state))
+        game = Game.new_game(user.key, SayerCategory.ACTOR, 0)
+        request = api.MAKE_MOVE_REQUEST.combined_message_class(
+            urlsafe_game_key=game.key.urlsafe(),
+            guess=random.choice([game.who_says, 'nobody']))
+        return lambda: service.make_move(request)
+
+    def cron(url):
+        return lambda state: lambda: call_app(main.app, url)
+
+    return collections.OrderedDict([
+        ('new_game', lambda state: lambda: service.new_game(
+            api.NEW_GAME_REQUEST.combined_message_class(
+                user_name=user_name(state),
+                sayer_category=SayerCategory.ACTOR,
+                num_hints=2))),
+        ('get_game', lambda state: lambda: service.get_game(
+            api.GET_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=random.choice(state['game_keys'])))),
+        ('make_move', make_move),
+        ('get_scores', lambda state: lambda: service.get_scores(
+            api.PAGE_REQUEST.combined_message_class())),
+        ('get_user_scores', lambda state: lambda: service.get_user_scores(
+            api.USER_PAGE_REQUEST.combined_message_class(
+                user_name=user_name(state)))),
+        ('get_user_games', lambda state: lambda: service.get_user_games(
+            api.USER_PAGE_REQUEST.combined_message_class(
+                user_name=user_name(state)))),
+        ('get_high_scores', lambda state: lambda: service.get_high_scores(
+            api.HIGH_SCORE_REQUEST.combined_message_class())),
+        ('get_average_game_points',
+         lambda state: lambda: service.get_average_game_points(
+             message_types.VoidMessage())),
+        ('get_user_rankings', lambda state: lambda: service.get_user_rankings(
+            api.RANKINGS_REQUEST.combined_message_class())),
+        ('get_user_rank', lambda state: lambda: service.get_user_rank(
+            api.USER_REQUEST.combined_message_class(
+                user_name=user_name(state)))),
+        ('get_game_analysis', lambda state: lambda: service.get_game_analysis(
+            api.PAGE_REQUEST.combined_message_class())),
+        ('get_game_rollups', lambda state: lambda: service.get_game_rollups(
+            api.ROLLUPS_REQUEST.combined_message_class())),
+        ('/crons/send_reminder', cron('/crons/send_reminder')),
+        ('/crons/rebuild_leaderboard', cron('/crons/rebuild_leaderboard')),
+        ('/crons/rebuild_game_rollups', cron('/crons/rebuild_game_rollups')),
+    ])
+
+
+def call_app(app, url, method='GET', body=''):
+    """Sends a request to a WSGI app, raising on an error status."""
+    import webapp2
+    response = webapp2.Request.blank(
+        url, method=method, body=body,
+        headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    ).get_response(app)
+    if response.status_int >= 400:
+        raise RuntimeError(response.status)
+
+
+def timed(operation):
+    """Runs operation and returns (seconds, API call counts, raised). The
+    ndb in-context cache is cleared first, as it would be at the start of
+    a real request, so entities read while seeding or by earlier
+    operations are not served without a datastore call."""
+    import instrumentation
+    from google.appengine.ext import ndb
+    ndb.get_context().clear_cache()
+    instrumentation.start()
+    start = time.time()
+    raised = False
+    try:
+        operation()
+    except Exception:
+        raised = True
+    return time.time() - start, instrumentation.stop(), raised
+
+
+def run_tasks(bed, stats):
+    """Runs the queued tasks, including any they enqueue, through main.app
+    and records them in stats under their URLs."""
+    import main
+    from google.appengine.ext import testbed
+
+    queue = bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    while True:
+        tasks = queue.get_filtered_tasks()
+        if not tasks:
+            return
+        queue.FlushQueue('default')
+        for task in tasks:
+            path = urlparse.urlparse(task.url).path
+            stats.setdefault(path, Stats()).add(*timed(
+                lambda: call_app(main.app, task.url, task.method,
+                                 task.payload or '')))
+
+
+def report(stats):
+    columns = ['datastore_get', 'datastore_put', 'datastore_query',
+               'memcache_hits', 'memcache_misses', 'task_enqueues']
+    print('{:<40} {:>6} {:>5} {:>8} {:>8} {:>8} {:>8} '
+          '{:>6} {:>6} {:>6} {:>6} {:>6} {:>6}'.format(
+              'scenario', 'calls', 'errs', 'ops/s', 'p50 ms', 'p90 ms',
+              'p99 ms', 'get', 'put', 'query', 'mc hit', 'mc mis', 'tasks'))
+    for name, stat in stats.items():
+        calls = len(stat.latencies)
+        per_call = [float(stat.rpcs[column]) / calls for column in columns]
+        print('{:<40} {:>6} {:>5} {:>8.1f} {:>8.2f} {:>8.2f} {:>8.2f} '
+              '{:>6.1f} {:>6.1f} {:>6.1f} {:>6.1f} {:>6.1f} {:>6.1f}'.format(
+                  name, calls, stat.errors,
+                  calls / sum(stat.latencies),
+                  stat.percentile(50) * 1000,
+                  stat.percentile(90) * 1000,
+                  stat.percentile(99) * 1000,
+                  *per_call))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help='Scenarios to run (default: all)')
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='Path to the App Engine Python SDK')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--game-data', type=int, default=100)
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.sdk:
+        setup_sdk(args.sdk)
+    random.seed(args.seed)
+    bed = activate_testbed()
+    try:
+        state = seed(args.users, args.game_data, args.games)
+        available = scenarios()
+        names = args.scenarios or list(available)
+        stats = collections.OrderedDict()
+        task_stats = collections.OrderedDict()
+        for name in names:
+            stat = stats.setdefault(name, Stats())
+            for _ in range(args.iterations):
+                operation = available[name](state)
+                run_tasks(bed, task_stats)
+                stat.add(*timed(operation))
+                run_tasks(bed, task_stats)
+        stats.update(task_stats)
+        report(stats)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
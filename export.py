@@ -0,0 +1,144 @@
+"""export.py - Exports Users and Games to Cloud Storage as newline-delimited
+JSON for offline analysis.
+
+An export walks each kind with a query cursor, one task per batch, and
+writes every batch to its own object:
+
+    /<bucket>/exports/<job id>/<kind>-<batch>.ndjson
+
+The ExportJob only moves on to the next batch once the object is written,
+so a failed task is retried from the batch it was writing, overwriting any
+partial object. An incremental export only includes the entities updated
+since the previous complete export started. Deleted and archived Games are
+not exported.
+
+Writing to Cloud Storage needs the App Engine cloudstorage client library
+(GoogleAppEngineCloudStorageClient), which is only imported once an export
+runs."""
+
+import datetime
+import json
+
+from google.appengine.api import app_identity, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import User, Game, ExportJob
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_KINDS = (User, Game)
+# Properties left out of the export, by kind.
+EXCLUDED_PROPERTIES = {'User': ['email']}
+
+
+def start(incremental=False):
+    """Starts an export. An incremental export with no complete export
+    before it exports everything.
+    Returns:
+        The new ExportJob."""
+    since = None
+    if incremental:
+        last = ExportJob.query(ExportJob.completed == True).order(
+            -ExportJob.started).get()
+        since = last and last.started
+    job = ExportJob(incremental=incremental,
+                    since=since,
+                    bucket=app_identity.get_default_gcs_bucket_name())
+    job.put()
+    _enqueue(job)
+    return job
+
+
+def resume(job_id):
+    """Re-enqueues the task for an ExportJob whose task chain was lost.
+    Returns False if there is no such unfinished job."""
+    job = ExportJob.get_by_id(job_id)
+    if not job or job.completed:
+        return False
+    _enqueue(job)
+    return True
+
+
+def _enqueue(job, transactional=False):
+    taskqueue.add(url='/tasks/export',
+                  params={'job': job.key.id()},
+                  transactional=transactional)
+
+
+def object_name(job, kind, batch):
+    return '/{}/exports/{}/{}-{:05d}.ndjson'.format(
+        job.bucket, job.key.id(), kind, batch)
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    raise TypeError(repr(value))
+
+
+def to_json(entity):
+    """Returns an entity as one line of JSON."""
+    record = entity.to_dict(
+        exclude=EXCLUDED_PROPERTIES.get(entity._get_kind(), []))
+    record['key'] = entity.key.urlsafe()
+    return json.dumps(record, default=_json_default, sort_keys=True)
+
+
+def available():
+    """True if the cloudstorage client library can be imported."""
+    try:
+        import cloudstorage
+    except ImportError:
+        return False
+    return True
+
+
+def _write(name, entities):
+    import cloudstorage
+    with cloudstorage.open(name, 'w',
+                           content_type='application/x-ndjson') as f:
+        for entity in entities:
+            f.write(to_json(entity) + '\n')
+
+
+def run_batch(job_id):
+    """Exports the next batch of an ExportJob and enqueues the task for the
+    batch after it."""
+    job = ExportJob.get_by_id(job_id)
+    if not job or job.completed:
+        return
+    model = EXPORT_KINDS[job.kind_index]
+    query = model.query()
+    if job.since:
+        query = model.query(model.updated >= job.since)
+    entities, next_cursor, more = query.fetch_page(
+        EXPORT_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=job.cursor) if job.cursor else None)
+    if entities:
+        _write(object_name(job, model._get_kind(), job.batch), entities)
+    _advance(job.key, job.kind_index, job.batch,
+             next_cursor.urlsafe() if more and next_cursor else None)
+
+
+@ndb.transactional
+def _advance(job_key, kind_index, batch, next_cursor):
+    """Records that a batch was written and enqueues the next one. Does
+    nothing if a duplicate task already recorded the batch."""
+    job = job_key.get()
+    if job.completed or (job.kind_index, job.batch) != (kind_index, batch):
+        return
+    if next_cursor:
+        job.batch += 1
+        job.cursor = next_cursor
+    else:
+        job.kind_index += 1
+        job.batch = 0
+        job.cursor = None
+    if job.kind_index == len(EXPORT_KINDS):
+        job.completed = True
+        job.finished = datetime.datetime.utcnow()
+    else:
+        _enqueue(job, transactional=True)
+    job.put()
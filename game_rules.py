@@ -0,0 +1,79 @@
+"""game_rules.py - The rules of Who Says, kept free of App Engine imports so
+that storage.py can run them in any Python process."""
+
+HINT_DELIMITER = '^^'
+MAX_HINTS = 5
+# points offered for a game, by number of hints bought
+POINTS_FOR_HINTS = (85, 80, 72, 59, 38, 4)
+HINT_SENTENCES = (
+    "The year it was said: %s.",
+    "The genre or industry in which it was said: %s.",
+    "The sayer's gender: %s.",
+    "The medium in which it was said: %s.",
+    "The sayer's initials: %s."
+)
+# the User stat that counts the games finished with each status
+FINISHED_GAME_COUNTERS = {
+    'WON': 'games_won',
+    'LOST': 'games_lost',
+    'CANCELLED': 'games_cancelled',
+}
+
+
+def points_for(num_hints):
+    """Returns the points a game offers after buying num_hints hints.
+    Raises:
+        ValueError: if num_hints is out of range."""
+    if num_hints < 0 or num_hints > MAX_HINTS:
+        raise ValueError('Number of hints must be between 0 and 5')
+    return POINTS_FOR_HINTS[num_hints]
+
+
+def hint_sentences(hints, num_hints):
+    """Returns the sentences for the first num_hints of a saying's hints."""
+    return [HINT_SENTENCES[x] % hints[x] for x in range(num_hints)]
+
+
+def parse_hints(hints):
+    """Returns the hints of a HINT_DELIMITER-joined string as a list.
+    Raises:
+        ValueError: if there are not exactly MAX_HINTS hints."""
+    parsed = hints.split(HINT_DELIMITER)
+    if len(parsed) != MAX_HINTS:
+        raise ValueError('Hints must be {} values separated by {}'.format(
+            MAX_HINTS, HINT_DELIMITER))
+    return parsed
+
+
+def split_hints(hints):
+    """Returns hints as a list, splitting a legacy HINT_DELIMITER-joined
+    string."""
+    if len(hints) == 1 and HINT_DELIMITER in hints[0]:
+        return hints[0].split(HINT_DELIMITER)
+    return list(hints)
+
+
+def outcome(who_says, guess):
+    """Returns the status a NEW game ends with after guess: WON if it
+    names the sayer, otherwise LOST."""
+    return 'WON' if guess == who_says else 'LOST'
+
+
+def count_new_game(stats, num_hints):
+    """Adds a newly created game to stats, a dict of a User's stats by
+    property name."""
+    stats['games_played'] = (stats.get('games_played') or 0) + 1
+    stats['hints_bought'] = (stats.get('hints_bought') or 0) + num_hints
+
+
+def count_finished_game(stats, status, sayer_category, points):
+    """Adds a game that has just been won, lost or cancelled to stats, a
+    dict of a User's stats by property name. Points for a win are added to
+    points_earned separately."""
+    counter = FINISHED_GAME_COUNTERS[status]
+    stats[counter] = (stats.get(counter) or 0) + 1
+    if status == 'WON':
+        by_category = dict(stats.get('points_by_category') or {})
+        by_category[sayer_category] = (
+            by_category.get(sayer_category, 0) + points)
+        stats['points_by_category'] = by_category
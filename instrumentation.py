@@ -0,0 +1,145 @@
+"""instrumentation.py - Per-request API call counts and timings.
+
+wrap() puts a WSGI middleware around an application. For each request it
+counts datastore gets, puts and queries, memcache hits and misses and task
+enqueues, measures the wall time, logs them as one JSON line and keeps them
+in a rolling window per endpoint. The window lives in instance memory, so
+get_summary() describes the requests served by this instance only."""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+STATS_WINDOW = 1000
+# Names are taken from the request path, which clients choose, so requests
+# beyond this many distinct names share one window.
+MAX_ENDPOINTS = 100
+OTHER_ENDPOINT = 'other'
+
+_local = threading.local()
+_lock = threading.Lock()
+# endpoint name -> deque of (wall time in ms, Counter of API calls)
+_recent = collections.defaultdict(
+    lambda: collections.deque(maxlen=STATS_WINDOW))
+
+_DATASTORE_CALLS = {'Get': 'datastore_get',
+                    'Put': 'datastore_put',
+                    'RunQuery': 'datastore_query',
+                    'Next': 'datastore_query'}
+
+
+def _active():
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    return _local.counters
+
+
+def _count(name, amount=1):
+    for counters in _active():
+        counters[name] += amount
+
+
+def _pre_call_hook(service, call, request, response):
+    if service == 'datastore_v3' and call in _DATASTORE_CALLS:
+        _count(_DATASTORE_CALLS[call])
+    elif service == 'taskqueue' and call in ('Add', 'BulkAdd'):
+        _count('task_enqueues',
+               request.add_request_size() if call == 'BulkAdd' else 1)
+
+
+def _post_call_hook(service, call, request, response):
+    if service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        _count('memcache_hits', hits)
+        _count('memcache_misses', request.key_size() - hits)
+
+
+def install_hooks():
+    """Registers the API call hooks. Safe to call more than once."""
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'instrumentation', _pre_call_hook)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'instrumentation', _post_call_hook)
+
+
+def start():
+    """Starts counting API calls made by the current thread. Calls to
+    start() and stop() may nest; each stop() returns the calls made since
+    its matching start()."""
+    _active().append(collections.Counter())
+
+
+def stop():
+    """Stops counting and returns the Counter of API calls since start()."""
+    return _active().pop()
+
+
+def endpoint_name(environ):
+    """Returns the endpoint method name for an SPI request, e.g.
+    'WhoSaysApi.get_game', and the path for any other request."""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith('/_ah/spi/'):
+        return path[len('/_ah/spi/'):]
+    return path
+
+
+def record(name, wall_ms, counters):
+    """Logs a request's stats and adds them to the rolling window. Once
+    MAX_ENDPOINTS names have windows, requests for any other name are kept
+    under OTHER_ENDPOINT."""
+    logging.info('request_stats %s', json.dumps(
+        dict(counters, endpoint=name, wall_ms=round(wall_ms, 2)),
+        sort_keys=True))
+    with _lock:
+        if name not in _recent and len(_recent) >= MAX_ENDPOINTS:
+            name = OTHER_ENDPOINT
+        _recent[name].append((wall_ms, counters))
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100.0), len(ordered) - 1)]
+
+
+def get_summary():
+    """Returns per-endpoint request counts, latency percentiles and mean
+    API calls per request over the rolling window."""
+    with _lock:
+        recent = dict((name, list(requests))
+                      for name, requests in _recent.items())
+    summary = {}
+    for name, requests in recent.items():
+        wall_times = [wall_ms for wall_ms, _ in requests]
+        totals = collections.Counter()
+        for _, counters in requests:
+            totals.update(counters)
+        summary[name] = {
+            'requests': len(requests),
+            'p50_ms': percentile(wall_times, 50),
+            'p90_ms': percentile(wall_times, 90),
+            'p99_ms': percentile(wall_times, 99),
+            'per_request': dict((counter, float(total) / len(requests))
+                                for counter, total in totals.items()),
+        }
+    return summary
+
+
+def wrap(app):
+    """Returns app wrapped in the instrumentation middleware."""
+    install_hooks()
+
+    def instrumented_app(environ, start_response):
+        start()
+        started = time.time()
+        try:
+            return app(environ, start_response)
+        finally:
+            record(endpoint_name(environ),
+                   (time.time() - started) * 1000,
+                   stop())
+    return instrumented_app
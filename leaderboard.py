@@ -0,0 +1,164 @@
+"""leaderboard.py - User rankings by points_earned. Keeps a snapshot of the
+top users in memcache and a sharded, hierarchical histogram of user scores
+(see score_tree.py) in the datastore, so that a single-user rank lookup
+reads a bounded number of counts instead of walking the Users."""
+
+import collections
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import score_tree
+from models import User, ScoreNode, RankedUser, NUM_SCORE_SHARDS
+
+LEADERBOARD_SIZE = 100
+MEMCACHE_LEADERBOARD = 'LEADERBOARD_TOP_N'
+CAS_RETRIES = 5
+LEADERBOARD_TTL = 60 * 60
+RANKED_USER_BATCH = 500
+
+
+def get_top_users():
+    """Returns the cached top users as a list of (name, points_earned)
+    tuples in descending order, rebuilding the snapshot on a miss."""
+    top = memcache.get(MEMCACHE_LEADERBOARD)
+    if top is None:
+        top = [(user.name, user.points_earned) for user in User.query(
+            User.points_earned > 0).order(-User.points_earned).fetch(
+                LEADERBOARD_SIZE)]
+        memcache.add(MEMCACHE_LEADERBOARD, top, time=LEADERBOARD_TTL)
+    return top
+
+
+def get_rankings(offset, limit):
+    """Returns one page of rankings as (rank, name, points_earned) tuples.
+    Pages within the snapshot are served from memcache."""
+    if offset + limit <= LEADERBOARD_SIZE:
+        page = get_top_users()[offset:offset + limit]
+    else:
+        page = [(user.name, user.points_earned) for user in User.query(
+            User.points_earned > 0).order(-User.points_earned).fetch(
+                limit, offset=offset)]
+    return [(offset + i + 1, name, points)
+            for i, (name, points) in enumerate(page)]
+
+
+def get_rank(user):
+    """Returns the 1-based rank of a User, or None if the User has not
+    earned any points yet. Users with equal points share a rank. Reads at
+    most (BRANCHING - 1) * TOP_LEVEL nodes of each shard, plus the few
+    TOP_LEVEL nodes above the User, whatever the number of Users."""
+    if user.points_earned <= 0:
+        return None
+    nodes, top_index = score_tree.nodes_above(user.points_earned)
+    keys = [ScoreNode.key_for(level, index, shard)
+            for level, index in nodes for shard in range(NUM_SCORE_SHARDS)]
+    ahead = sum(node.num_users for node in ndb.get_multi(keys) if node)
+    ahead += sum(node.num_users for node in ScoreNode.query(
+        ScoreNode.level == score_tree.TOP_LEVEL,
+        ScoreNode.index > top_index))
+    return ahead + 1
+
+
+@ndb.transactional(xg=True)
+def _move_in_histogram(user_key):
+    """Moves a User to the ScoreNodes for its current points_earned. The
+    points the User was counted at are read from its RankedUser, so
+    applying the same change twice or out of order is a no-op. Only the
+    nodes that differ between the old and new points are written, each in
+    a random shard. Returns the User."""
+    user = user_key.get()
+    if not user:
+        return None
+    ranked = (RankedUser.key_for(user.name).get() or
+              RankedUser(key=RankedUser.key_for(user.name)))
+    new_points = user.points_earned if user.points_earned > 0 else None
+    if ranked.points == new_points:
+        return user
+    old_nodes = set(score_tree.nodes_for(ranked.points)
+                    if ranked.points else [])
+    new_nodes = set(score_tree.nodes_for(new_points) if new_points else [])
+    changes = ([(node, -1) for node in old_nodes - new_nodes] +
+               [(node, 1) for node in new_nodes - old_nodes])
+    keys = [ScoreNode.key_for(level, index,
+                              random.randrange(NUM_SCORE_SHARDS))
+            for (level, index), _ in changes]
+    entities = [ranked]
+    for key, node, ((level, index), delta) in zip(
+            keys, ndb.get_multi(keys), changes):
+        node = node or ScoreNode(key=key, level=level, index=index)
+        node.num_users += delta
+        entities.append(node)
+    ranked.points = new_points
+    ndb.put_multi(entities)
+    return user
+
+
+def _update_snapshot(name, points):
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        top = client.gets(MEMCACHE_LEADERBOARD)
+        if top is None:
+            # Nothing cached yet; the next read builds a fresh snapshot.
+            return
+        if any(entry[0] == name and entry[1] >= points for entry in top):
+            # Points never go down, so an entry at least this high is newer.
+            return
+        entries = [entry for entry in top if entry[0] != name]
+        if len(entries) >= LEADERBOARD_SIZE and points <= entries[-1][1]:
+            return
+        entries.append((name, points))
+        entries.sort(key=lambda entry: -entry[1])
+        if client.cas(MEMCACHE_LEADERBOARD, entries[:LEADERBOARD_SIZE],
+                      time=LEADERBOARD_TTL):
+            return
+    memcache.delete(MEMCACHE_LEADERBOARD)
+
+
+def record_points_change(name):
+    """Applies a User's current points_earned to the score histogram and
+    the cached top users. The User is re-read rather than trusting the
+    points in the task, so retried and reordered tasks are safe."""
+    user = User.get_by_name(name)
+    if not user:
+        return
+    user = _move_in_histogram(user.key)
+    if user and user.points_earned > 0:
+        _update_snapshot(user.name, user.points_earned)
+
+
+def rebuild():
+    """Recomputes the score histogram, the RankedUser of every User and the
+    top users snapshot from the User entities. Counts are written to shard
+    0 of each node and the other shards are deleted."""
+    counts = collections.Counter()
+    points = {}
+    for user in User.query(User.points_earned > 0):
+        counts.update(score_tree.nodes_for(user.points_earned))
+        points[user.name] = user.points_earned
+    nodes = [ScoreNode(key=ScoreNode.key_for(level, index, 0), level=level,
+                       index=index, num_users=count)
+             for (level, index), count in counts.items()]
+    keep = set(node.key for node in nodes)
+    ndb.delete_multi([key for key in ScoreNode.query().iter(keys_only=True)
+                      if key not in keep])
+    ndb.put_multi(nodes)
+    changed = [RankedUser(key=key, points=points.get(key.id()))
+               for key, ranked in _all_ranked_users(points)
+               if not ranked or ranked.points != points.get(key.id())]
+    ndb.put_multi(changed)
+    memcache.delete(MEMCACHE_LEADERBOARD)
+    get_top_users()
+
+
+def _all_ranked_users(points):
+    """Yields (key, RankedUser or None) for every User in points and every
+    existing RankedUser."""
+    keys = set(RankedUser.key_for(name) for name in points)
+    keys.update(RankedUser.query().iter(keys_only=True))
+    keys = list(keys)
+    for i in range(0, len(keys), RANKED_USER_BATCH):
+        batch = keys[i:i + RANKED_USER_BATCH]
+        for key, ranked in zip(batch, ndb.get_multi(batch)):
+            yield key, ranked
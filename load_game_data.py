@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""load_game_data.py - Offline loader that streams game data from a CSV or
+JSONL file into the add_data_batch endpoint.
+
+CSV files need a header row with the columns sayer_category, sayer, saying
+and hints. JSONL files hold one object per line with the same keys. Hints
+are '^^'-delimited, exactly as for add_data.
+
+Progress is recorded in <file>.progress after every batch, so an
+interrupted load picks up after the last batch that was accepted.
+
+Usage:
+    python load_game_data.py sayings.csv
+    python load_game_data.py sayings.jsonl \\
+        --api https://your-app-id.appspot.com/_ah/api/whosaysendpoints/v1
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import urllib2
+
+FIELDS = ('sayer_category', 'sayer', 'saying', 'hints')
+DEFAULT_API = 'http://localhost:8080/_ah/api/whosaysendpoints/v1'
+
+
+def read_records(path):
+    """Yields game data dicts from a CSV or JSONL file."""
+    with open(path, 'rb') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield dict((field, row[field].decode('utf-8'))
+                           for field in FIELDS)
+        else:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield dict((field, record[field]) for field in FIELDS)
+
+
+def read_progress(progress_path):
+    if not os.path.exists(progress_path):
+        return 0
+    with open(progress_path) as f:
+        return int(f.read().strip() or 0)
+
+
+def write_progress(progress_path, done):
+    with open(progress_path, 'w') as f:
+        f.write(str(done))
+
+
+def post_batch(api, batch):
+    request = urllib2.Request(api.rstrip('/') + '/adddata/batch',
+                              json.dumps({'game_data': batch}),
+                              {'Content-Type': 'application/json'})
+    return json.load(urllib2.urlopen(request))['message']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='CSV or JSONL file of game data')
+    parser.add_argument('--api', default=DEFAULT_API,
+                        help='Base URL of the whosaysendpoints API')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore recorded progress and load everything')
+    args = parser.parse_args()
+
+    progress_path = args.path + '.progress'
+    done = 0 if args.restart else read_progress(progress_path)
+    if done:
+        sys.stderr.write('Resuming after {} records.\n'.format(done))
+
+    records = itertools.islice(read_records(args.path), done, None)
+    while True:
+        batch = list(itertools.islice(records, args.batch_size))
+        if not batch:
+            break
+        message = post_batch(args.api, batch)
+        done += len(batch)
+        write_progress(progress_path, done)
+        sys.stderr.write('{} ({} records loaded)\n'.format(message, done))
+
+    sys.stderr.write('Done.\n')
+
+
+if __name__ == '__main__':
+    main()
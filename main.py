@@ -1,42 +1,480 @@
 #!/usr/bin/env python
 
 """main.py - This file contains handlers that are called by taskqueue and/or
-cronjobs."""
+cronjobs, and the warmup handler.
+
+Modules that only some handlers need, including the endpoints API, are
+imported inside those handlers so that loading main.py stays cheap on a
+fresh instance."""
+
+import collections
+import datetime
+import json
+import logging
 
 import webapp2
-from google.appengine.api import mail, app_identity
-from whosays_api import WhoSaysApi
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+import instrumentation
+import leaderboard
+import response_cache
+
+from models import (
+    User,
+    Game,
+    GameData,
+    GamePointsShard,
+    GameRollup,
+    GameHistory,
+    HighScoreTable,
+    SayerCategory,
+    MAX_TRANSACTION_GROUPS,
+    STALE_GAME_AGE,
+    ARCHIVE_GAME_AGE)
+
+
+REMINDER_BATCH_SIZE = 100
+MIGRATION_BATCH_SIZE = 100
+# Seconds between blocking a legacy User and re-keying it, and between
+# re-keying it and sweeping for games the re-key's query missed.
+REKEY_DELAY = 60
+ARCHIVE_BATCH_SIZE = 200
+CUTOFF_FORMAT = '%Y%m%d%H%M%S'
+
 
-from models import User, Game
+def _enqueue_reminder_batch(run_id, page, cursor=None, skip=0):
+    """Adds the task that mails one page of reminders. Tasks are named after
+    their position in the run so that a repeated enqueue is a no-op."""
+    params = {'run_id': run_id, 'page': page, 'skip': skip}
+    if cursor:
+        params['cursor'] = cursor
+    try:
+        taskqueue.add(url='/tasks/send_reminder_batch',
+                      name='reminder-{}-{}-{}'.format(run_id, page, skip),
+                      params=params)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
+        """Start sending a reminder email to each User with unfinished games.
+        Called every 24 hours using a cron job"""
+        run_id = datetime.datetime.utcnow().strftime('%Y%m%d%H%M')
+        _enqueue_reminder_batch(run_id, 0)
+
+
+class SendReminderEmailBatch(webapp2.RequestHandler):
+    def post(self):
+        """Send reminder emails to one page of Users with NEW games and chain
+        the task for the next page. If the deadline hits while mailing, the
+        rest of the page is re-enqueued rather than starting it over."""
+        from google.appengine.api import mail, app_identity
+        from google.appengine.runtime import DeadlineExceededError
+
+        run_id = self.request.get('run_id')
+        page = int(self.request.get('page'))
+        skip = int(self.request.get('skip') or 0)
+        cursor = self.request.get('cursor') or None
+
+        games, next_cursor, more = Game.query(
+            Game.status == 'NEW',
+            projection=[Game.user],
+            distinct=True).fetch_page(
+                REMINDER_BATCH_SIZE,
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        if more and next_cursor:
+            _enqueue_reminder_batch(run_id, page + 1, next_cursor.urlsafe())
+
+        users = ndb.get_multi([game.user for game in games[skip:]])
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != "")
-        for user in users:
-            active_games = Game.query(Game.user == user.key).filter(
-                Game.status == 'NEW')
-            if active_games:
-                subject = "'Who Says' game reminder!"
-                body = "Hello {}, you have one or more unfinished" \
-                    " 'Who Says' games!".format(user.name)
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
+        subject = "'Who Says' game reminder!"
+        sent = 0
+        try:
+            for user in users:
+                if user and user.email:
+                    body = "Hello {}, you have one or more unfinished" \
+                        " 'Who Says' games!".format(user.name)
+                    mail.send_mail(
+                        'noreply@{}.appspotmail.com'.format(app_id),
+                        user.email,
+                        subject,
+                        body)
+                sent += 1
+        except DeadlineExceededError:
+            _enqueue_reminder_batch(run_id, page, cursor, skip + sent)
 
 
 class UpdateAverageGamePoints(webapp2.RequestHandler):
     def post(self):
-        """Update game listing announcement in memcache."""
+        """Update game listing announcement in memcache. Wins now schedule
+        the coalesced average_game_points refresh instead; this route
+        serves tasks enqueued before that."""
+        from whosays_api import WhoSaysApi
+        WhoSaysApi._cache_average_game_points()
+        self.response.set_status(204)
+
+
+class RunRefresh(webapp2.RequestHandler):
+    def post(self):
+        """Run a coalesced refresh scheduled with refresh.schedule()."""
+        import refresh
+        # Imported for the refreshes it registers.
+        import whosays_api
+        refresh.run(self.request.get('name'))
+        self.response.set_status(204)
+
+
+class ReconcileAverageGamePoints(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the average game points aggregate from scratch.
+        Called daily using a cron job"""
+        from whosays_api import WhoSaysApi
+        GamePointsShard.rebuild()
+        response_cache.bump(response_cache.SCORES_SCOPE)
+        WhoSaysApi._cache_average_game_points()
+
+
+class UpdateLeaderboard(webapp2.RequestHandler):
+    def post(self):
+        """Apply the current points of one or more Users to the
+        leaderboard."""
+        for name in self.request.get_all('name'):
+            leaderboard.record_points_change(name)
+        self.response.set_status(204)
+
+
+class RecordGameResult(webapp2.RequestHandler):
+    def post(self):
+        """Add one or more finished games to the game rollups and high
+        scores."""
+        high_scores_changed = False
+        for urlsafe in self.request.get_all('game'):
+            game_key = ndb.Key(urlsafe=urlsafe)
+            GameRollup.record_game(game_key)
+            game = game_key.get()
+            if game and game.status == 'WON':
+                if HighScoreTable.record_win(game, game.user.get().name):
+                    high_scores_changed = True
+        if high_scores_changed:
+            response_cache.bump(response_cache.SCORES_SCOPE)
+        self.response.set_status(204)
+
+
+class RebuildGameRollups(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the game rollups from scratch.
+        Called daily using a cron job"""
+        GameRollup.rebuild()
+
+
+class RebuildHighScores(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the high score table from scratch.
+        Called daily using a cron job"""
+        HighScoreTable.rebuild()
+        response_cache.bump(response_cache.SCORES_SCOPE)
+
+
+class RebuildLeaderboard(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the leaderboard histogram and snapshot from scratch.
+        Called daily using a cron job"""
+        leaderboard.rebuild()
+
+
+class MigrateGameDataHints(webapp2.RequestHandler):
+    def get(self):
+        """Start rewriting legacy GameData hints as repeated values.
+        Visited once by an administrator."""
+        taskqueue.add(url='/tasks/migrate_game_data_hints')
+        self.response.write('GameData hints migration started.')
+
+    def post(self):
+        """Migrate one batch of GameData and chain the next batch."""
+        cursor = self.request.get('cursor') or None
+        batch, next_cursor, more = GameData.query().fetch_page(
+            MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        legacy = [game_data for game_data in batch if game_data.is_legacy()]
+        for game_data in legacy:
+            game_data.hints = game_data.hint_list()
+        ndb.put_multi(legacy)
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/migrate_game_data_hints',
+                          params={'cursor': next_cursor.urlsafe()})
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ArchiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Start expiring stale NEW games and archiving old finished games.
+        Called daily using a cron job"""
+        now = datetime.datetime.utcnow()
+        taskqueue.add(url='/tasks/archive_games', params={
+            'phase': 'expire',
+            'expire_before': (now - STALE_GAME_AGE).strftime(CUTOFF_FORMAT),
+            'archive_before': (now - ARCHIVE_GAME_AGE).strftime(
+                CUTOFF_FORMAT)})
+
+    def post(self):
+        """Expire or archive one batch of games and chain the next batch.
+        Once every stale NEW game is expired, the finished games are
+        archived. Cutoffs later than STALE_GAME_AGE or ARCHIVE_GAME_AGE
+        allow are ignored."""
+        phase = self.request.get('phase')
+        cursor = self.request.get('cursor') or None
+        params = {'phase': phase,
+                  'expire_before': self.request.get('expire_before'),
+                  'archive_before': self.request.get('archive_before')}
+        now = datetime.datetime.utcnow()
+        if phase == 'expire':
+            cutoff = datetime.datetime.strptime(params['expire_before'],
+                                                CUTOFF_FORMAT)
+            if cutoff > now - STALE_GAME_AGE:
+                logging.warning('Ignoring expiry cutoff %s.', cutoff)
+                return
+            query = Game.query(Game.status == 'NEW', Game.created < cutoff)
+        else:
+            cutoff = datetime.datetime.strptime(params['archive_before'],
+                                                CUTOFF_FORMAT)
+            if cutoff > now - ARCHIVE_GAME_AGE:
+                logging.warning('Ignoring archive cutoff %s.', cutoff)
+                return
+            query = Game.query(Game.ended < cutoff)
+        batch, next_cursor, more = query.fetch_page(
+            ARCHIVE_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+        removed = []
+        if phase == 'expire':
+            removed.extend(Game.expire(batch, cutoff))
+        else:
+            by_user = collections.defaultdict(list)
+            for game in batch:
+                by_user[game.user].append(game.key)
+            for user_key, keys in by_user.items():
+                # The user's history takes one of the entity groups.
+                for chunk in _chunks(keys, MAX_TRANSACTION_GROUPS - 1):
+                    removed.extend(GameHistory.archive(user_key, chunk,
+                                                       cutoff))
+        if removed:
+            scopes = set(response_cache.user_scope(game.user)
+                         for game in removed)
+            scopes.update(response_cache.game_scope(game.key.urlsafe())
+                          for game in removed)
+            response_cache.bump(*scopes)
+
+        if more and next_cursor:
+            params['cursor'] = next_cursor.urlsafe()
+            taskqueue.add(url='/tasks/archive_games', params=params)
+        elif phase == 'expire':
+            params['phase'] = 'archive'
+            taskqueue.add(url='/tasks/archive_games', params=params)
+
+
+@ndb.transactional(xg=True)
+def _start_rekey(old_key):
+    """Blocks game writes to a legacy User and copies it to its name-keyed
+    entity, which is blocked too. Returns False if the name is taken."""
+    user = old_key.get()
+    if not user:
+        return False
+    new_key = ndb.Key(User, user.name)
+    taken = new_key.get()
+    if taken and not taken.rekeying:
+        logging.warning('Not re-keying User %s: %s is already taken.',
+                        old_key.id(), user.name)
+        return False
+    user.rekeying = True
+    ndb.put_multi([user, User(key=new_key, **user.to_dict())])
+    return True
+
+
+@ndb.transactional(xg=True)
+def _repoint_games(game_keys, old_key, new_key):
+    """Points the games that still belong to old_key at new_key. At most
+    MAX_TRANSACTION_GROUPS keys may be passed."""
+    games = [game for game in ndb.get_multi(game_keys)
+             if game and game.user == old_key]
+    for game in games:
+        game.user = new_key
+    ndb.put_multi(games)
+
+
+def _repoint_all_games(old_key, new_key):
+    # The query is only eventually consistent; each game is re-read in
+    # its transaction, and the sweep phase catches any stragglers.
+    keys = Game.query(Game.user == old_key).fetch(keys_only=True)
+    for chunk in _chunks(keys, MAX_TRANSACTION_GROUPS):
+        _repoint_games(chunk, old_key, new_key)
+
+
+@ndb.transactional(xg=True)
+def _finish_rekey(old_key, new_key):
+    """Copies the legacy User's final state to its name-keyed entity,
+    unblocks it and deletes the original."""
+    user = old_key.get()
+    if not user:
+        return
+    new_user = User(key=new_key, **user.to_dict())
+    new_user.rekeying = False
+    new_user.put()
+    old_key.delete()
+
+
+def _rekey_user(old_key):
+    """Moves a blocked legacy User's Games and GameHistory to its
+    name-keyed entity and deletes the original. Returns the new key, or
+    None if the User is gone."""
+    user = old_key.get()
+    if not user:
+        return None
+    new_key = ndb.Key(User, user.name)
+    _repoint_all_games(old_key, new_key)
+    GameHistory.move(old_key, new_key)
+    _finish_rekey(old_key, new_key)
+    User.forget_name(user.name)
+    return new_key
+
+
+class MigrateUsers(webapp2.RequestHandler):
+    def get(self):
+        """Start re-keying legacy Users by name.
+        Visited once by an administrator."""
+        taskqueue.add(url='/tasks/migrate_users')
+        self.response.write('User migration started.')
+
+    def post(self):
+        """Block one batch of legacy Users and chain the next batch. Each
+        blocked User is re-keyed REKEY_DELAY seconds later, once queries
+        for its games have caught up, and swept for games the re-key
+        missed REKEY_DELAY seconds after that. Game writes for a User are
+        refused while it is blocked."""
+        user = self.request.get('user')
+        if user:
+            old_key = ndb.Key(urlsafe=user)
+            if self.request.get('phase') == 'sweep':
+                _repoint_all_games(old_key, ndb.Key(
+                    urlsafe=self.request.get('new_user')))
+                return
+            new_key = _rekey_user(old_key)
+            if new_key:
+                taskqueue.add(url='/tasks/migrate_users',
+                              params={'user': user, 'phase': 'sweep',
+                                      'new_user': new_key.urlsafe()},
+                              countdown=REKEY_DELAY)
+            return
+
+        cursor = self.request.get('cursor') or None
+        batch, next_cursor, more = User.query().fetch_page(
+            MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        for user in batch:
+            if user.key.id() != user.name and _start_rekey(user.key):
+                taskqueue.add(url='/tasks/migrate_users',
+                              params={'user': user.key.urlsafe()},
+                              countdown=REKEY_DELAY)
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/migrate_users',
+                          params={'cursor': next_cursor.urlsafe()})
+
+
+class Warmup(webapp2.RequestHandler):
+    def get(self):
+        """Import the endpoints API and fill the caches that the first
+        requests to a fresh instance would otherwise fill. Called by App
+        Engine before an instance is sent traffic."""
+        from whosays_api import WhoSaysApi
+        for category in SayerCategory:
+            GameData.get_pool(category.name)
+        leaderboard.get_top_users()
         WhoSaysApi._cache_average_game_points()
+        self.response.set_status(200)
+
+
+class StartExport(webapp2.RequestHandler):
+    def get(self):
+        """Start exporting Users and Games to Cloud Storage, or resume the
+        export given by the job parameter. Visited by an administrator,
+        or daily by a cron job for an incremental export once one is
+        configured."""
+        import export
+        if not export.available():
+            logging.error('Not exporting: the cloudstorage library is not '
+                          'in the application directory.')
+            self.abort(503)
+        job_id = self.request.get('job')
+        if job_id:
+            if not export.resume(int(job_id)):
+                self.abort(404)
+            self.response.write('Export {} resumed.'.format(job_id))
+            return
+        job = export.start(incremental=bool(self.request.get('incremental')))
+        self.response.write('Export {} started.'.format(job.key.id()))
+
+
+class ExportBatch(webapp2.RequestHandler):
+    def post(self):
+        """Export one batch and chain the next batch."""
+        import export
+        export.run_batch(int(self.request.get('job')))
         self.response.set_status(204)
 
 
-app = webapp2.WSGIApplication([
+class RebuildUserStats(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing every User's stats from their games.
+        Visited by an administrator, e.g. once after the stats were
+        added."""
+        taskqueue.add(url='/tasks/rebuild_user_stats')
+        self.response.write('User stats rebuild started.')
+
+    def post(self):
+        """Rebuild one batch of Users' stats and chain the next batch."""
+        cursor = self.request.get('cursor') or None
+        batch, next_cursor, more = User.query().fetch_page(
+            MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None,
+            keys_only=True)
+        for user_key in batch:
+            User.rebuild_stats(user_key)
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/rebuild_user_stats',
+                          params={'cursor': next_cursor.urlsafe()})
+
+
+class RequestStats(webapp2.RequestHandler):
+    def get(self):
+        """Return this instance's recent per-endpoint request stats."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrumentation.get_summary(),
+                                       indent=2, sort_keys=True))
+
+
+app = instrumentation.wrap(webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/crons/reconcile_average_game_points', ReconcileAverageGamePoints),
+    ('/crons/rebuild_leaderboard', RebuildLeaderboard),
+    ('/crons/rebuild_game_rollups', RebuildGameRollups),
+    ('/crons/rebuild_high_scores', RebuildHighScores),
+    ('/crons/archive_games', ArchiveGames),
+    ('/crons/export', StartExport),
     ('/tasks/cache_average_game_points', UpdateAverageGamePoints),
-], debug=True)
+    ('/tasks/refresh', RunRefresh),
+    ('/tasks/send_reminder_batch', SendReminderEmailBatch),
+    ('/tasks/update_leaderboard', UpdateLeaderboard),
+    ('/tasks/record_game_result', RecordGameResult),
+    ('/tasks/migrate_game_data_hints', MigrateGameDataHints),
+    ('/tasks/migrate_users', MigrateUsers),
+    ('/tasks/rebuild_user_stats', RebuildUserStats),
+    ('/tasks/archive_games', ArchiveGames),
+    ('/tasks/export', ExportBatch),
+    ('/admin/stats', RequestStats),
+    ('/_ah/warmup', Warmup),
+], debug=True))
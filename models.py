@@ -2,28 +2,234 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import bisect
+import collections
+import datetime
+import itertools
+import random
+import time
+
 from protorpc import messages
 from google.appengine.ext import ndb
-from google.appengine.api import taskqueue
+from google.appengine.api import memcache, taskqueue
+
+from batching import chunk_by_groups
+import game_rules
+from game_rules import (MAX_HINTS, points_for, hint_sentences, parse_hints,
+                        split_hints)
+from utils import LRUCache, add_tasks_async, get_user_names
+
+
+MEMCACHE_USER_KEY = u'USER_KEY_{}'
+# The User properties kept up to date by the game_rules stat counters.
+USER_STATS = ['games_played', 'games_won', 'games_lost', 'games_cancelled',
+              'hints_bought', 'points_by_category']
+
+# user name -> User key
+_user_keys = LRUCache(max_size=10000, ttl=3600)
+
+
+class UserUnavailableError(Exception):
+    """Raised by writes to a User that is being re-keyed by MigrateUsers in
+    main.py, or whose games still point at its deleted legacy key."""
+
+
+class BatchInterruptedError(UserUnavailableError):
+    """Raised by Game.start_games when a User became unavailable after
+    earlier transactions of the batch had committed. started holds the
+    Games that were written."""
+
+    def __init__(self, message, started):
+        super(BatchInterruptedError, self).__init__(message)
+        self.started = started
 
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile. Users are keyed by name; Users created before that
+    have numeric ids until MigrateUsers in main.py re-keys them."""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
     points_earned = ndb.IntegerProperty(default=0)
+    updated = ndb.DateTimeProperty(auto_now=True)
+    # Stats, kept up to date in the transactions that start and end games.
+    games_played = ndb.IntegerProperty(default=0, indexed=False)
+    games_won = ndb.IntegerProperty(default=0, indexed=False)
+    games_lost = ndb.IntegerProperty(default=0, indexed=False)
+    games_cancelled = ndb.IntegerProperty(default=0, indexed=False)
+    hints_bought = ndb.IntegerProperty(default=0, indexed=False)
+    # sayer_category -> points won
+    points_by_category = ndb.JsonProperty(indexed=False)
+    # Set while MigrateUsers re-keys the User; blocks game writes.
+    rekeying = ndb.BooleanProperty(default=False, indexed=False)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with the given name, or None."""
+        return cls.get_by_name_async(name).get_result()
 
-    def to_ranking(self):
+    @classmethod
+    @ndb.tasklet
+    def get_by_name_async(cls, name):
+        """Tasklet version of get_by_name. The name -> key mapping is cached
+        so that legacy Users are only queried for once; the entity itself is
+        then a key get."""
+        if not name:
+            raise ndb.Return(None)
+        context = ndb.get_context()
+        memcache_key = MEMCACHE_USER_KEY.format(name)
+        key = _user_keys.get(name)
+        if not key:
+            key = yield context.memcache_get(memcache_key)
+        if key:
+            user = yield key.get_async()
+            if user:
+                _user_keys.set(name, key)
+                raise ndb.Return(user)
+            # The cached key is stale, e.g. the User has been re-keyed.
+            _user_keys.delete(name)
+            yield context.memcache_delete(memcache_key)
+
+        user = yield ndb.Key(cls, name).get_async()
+        if not user:
+            user = yield cls.query(cls.name == name).get_async()
+        if user:
+            _user_keys.set(name, user.key)
+            yield context.memcache_set(memcache_key, user.key)
+        raise ndb.Return(user)
+
+    @classmethod
+    def create(cls, name, email=None):
+        """Creates a User keyed by name. Returns None if the name is
+        already taken."""
+        if cls.get_by_name(name):
+            return None
+
+        @ndb.transactional
+        def _create():
+            key = ndb.Key(cls, name)
+            if key.get():
+                return None
+            user = cls(key=key, name=name, email=email)
+            user.put()
+            return user
+        return _create()
+
+    @staticmethod
+    def forget_name(name):
+        """Drops the cached key for a User name."""
+        _user_keys.delete(name)
+        memcache.delete(MEMCACHE_USER_KEY.format(name))
+
+    @staticmethod
+    def check_writable(user):
+        """Raises UserUnavailableError if user, read in the transaction
+        that is about to write it, is missing or being re-keyed."""
+        if not user or user.rekeying:
+            raise UserUnavailableError(
+                'This user is being migrated. Please try again shortly.')
+
+    def count_new_game(self, game):
+        """Adds a newly created Game to the stats."""
+        stats = self.to_dict(include=USER_STATS)
+        game_rules.count_new_game(stats, game.num_hints)
+        self.populate(**stats)
+
+    def uncount_new_game(self, game):
+        """Takes a Game that is deleted before it was played back out of
+        the stats."""
+        self.games_played = max(self.games_played - 1, 0)
+        self.hints_bought = max(self.hints_bought - game.num_hints, 0)
+
+    def count_finished_game(self, game):
+        """Adds a Game that has just been won, lost or cancelled to the
+        stats. Points for a win are added to points_earned separately."""
+        stats = self.to_dict(include=USER_STATS)
+        game_rules.count_finished_game(stats, game.status,
+                                       game.sayer_category, game.points)
+        self.populate(**stats)
+
+    @classmethod
+    def rebuild_stats(cls, user_key):
+        """Recomputes a User's stats from their games, archived games
+        included. The games are read before the transaction, so a game
+        started, finished or expired meanwhile can leave the stats off by
+        that game. Nothing rebuilds the stats again automatically; an
+        administrator has to revisit /tasks/rebuild_user_stats."""
+        games = list(itertools.chain(
+            Game.query(Game.user == user_key),
+            itertools.chain.from_iterable(
+                history.games()
+                for history in GameHistory.query(ancestor=user_key))))
+
+        @ndb.transactional
+        def _rebuild():
+            user = user_key.get()
+            if not user or user.rekeying:
+                return
+            user.games_played = user.games_won = user.games_lost = 0
+            user.games_cancelled = user.hints_bought = 0
+            user.points_by_category = None
+            for game in games:
+                user.count_new_game(game)
+                user.count_finished_game(game)
+            user.put()
+        _rebuild()
+
+    def to_stats_form(self):
+        form = UserStatsForm()
+        form.user_name = self.name
+        form.games_played = self.games_played
+        form.games_won = self.games_won
+        form.games_lost = self.games_lost
+        form.games_cancelled = self.games_cancelled
+        form.hints_bought = self.hints_bought
+        form.points_earned = self.points_earned
+        form.points_by_category = [
+            CategoryPoints(sayer_category=category, points=points)
+            for category, points
+            in sorted((self.points_by_category or {}).items())]
+        return form
+
+    def to_ranking(self, rank=None):
         form = RankingForm()
         form.name = self.name
         form.points_earned = self.points_earned
+        form.rank = rank
         return form
 
 
+NUM_SCORE_SHARDS = 4
+
+
+class ScoreNode(ndb.Model):
+    """One shard of the number of Users whose points_earned fall in node
+    index of a level of the score_tree histogram. Changes go to a random
+    shard, so a single shard may hold a negative count; only the sum over
+    the NUM_SCORE_SHARDS shards is meaningful."""
+    level = ndb.IntegerProperty(required=True)
+    index = ndb.IntegerProperty(required=True)
+    num_users = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def key_for(cls, level, index, shard):
+        return ndb.Key(cls, '{}:{}:{}'.format(level, index, shard))
+
+
+class RankedUser(ndb.Model):
+    """The points a User is currently counted at in the ScoreNodes, keyed
+    by User name. points is None while the User is not counted."""
+    points = ndb.IntegerProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, name):
+        return ndb.Key(cls, name)
+
+
 class RankingForm(messages.Message):
     """Ranking form"""
     name = messages.StringField(1, required=True)
     points_earned = messages.IntegerField(2, required=True)
+    rank = messages.IntegerField(3)
 
 
 class Rankings(messages.Message):
@@ -31,27 +237,204 @@ class Rankings(messages.Message):
     rankings = messages.MessageField(RankingForm, 1, repeated=True)
 
 
+class CategoryPoints(messages.Message):
+    """Points won in one sayer_category."""
+    sayer_category = messages.StringField(1, required=True)
+    points = messages.IntegerField(2, required=True)
+
+
+class UserStatsForm(messages.Message):
+    """UserStatsForm for outbound User stats."""
+    user_name = messages.StringField(1, required=True)
+    games_played = messages.IntegerField(2, required=True)
+    games_won = messages.IntegerField(3, required=True)
+    games_lost = messages.IntegerField(4, required=True)
+    games_cancelled = messages.IntegerField(5, required=True)
+    hints_bought = messages.IntegerField(6, required=True)
+    points_earned = messages.IntegerField(7, required=True)
+    points_by_category = messages.MessageField(CategoryPoints, 8,
+                                               repeated=True)
+
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     message = messages.StringField(1, required=True)
 
 
+# Pools hold GameData ids rather than keys: a pickled ndb.Key takes over
+# 100 bytes, which put pools of about 10,000 sayings past memcache's 1 MB
+# value limit, while a pickled integer id takes at most 5.
+MEMCACHE_GAME_DATA_POOL = 'GAME_DATA_POOL_IDS_{}'
+GAME_DATA_POOL_TTL = 300
+# The memcache copy expires so that a lost update is repaired by a fresh
+# query within a day.
+MEMCACHE_GAME_DATA_POOL_TTL = 24 * 60 * 60
+POOL_CAS_RETRIES = 5
+
+# sayer_category -> (expiry time, list of GameData ids)
+_game_data_pools = {}
+
+IMPORT_CHUNK_SIZE = 200
+
+# GameData key -> GameDataRecord
+_game_data_cache = LRUCache(max_size=1000, ttl=600)
+
+GameDataRecord = collections.namedtuple(
+    'GameDataRecord', ['key', 'sayer_category', 'sayer', 'saying', 'hints'])
+
+
 class GameData(ndb.Model):
-    """Data used for game play."""
+    """Data used for game play. Entities written before hints became a
+    repeated property hold a single HINT_DELIMITER-joined string, which
+    hint_list() splits; MigrateGameDataHints in main.py rewrites them."""
     sayer_category = ndb.StringProperty(required=True)
     sayer = ndb.StringProperty(required=True)
     saying = ndb.StringProperty(required=True)
-    hints = ndb.StringProperty(required=True)
+    hints = ndb.StringProperty(repeated=True)
 
     @classmethod
     def new_game_data(cls, sayer_category, sayer, saying, hints):
+        """Creates GameData from a HINT_DELIMITER-joined hints string.
+        Raises:
+            ValueError: if hints does not hold MAX_HINTS hints."""
         game_data = GameData(sayer_category=sayer_category,
                              sayer=sayer,
                              saying=saying,
-                             hints=hints)
+                             hints=parse_hints(hints))
         game_data.put()
+        _game_data_cache.delete(game_data.key)
+        cls.add_to_pool(game_data.sayer_category, [game_data.key])
         return game_data
 
+    @classmethod
+    def new_game_data_multi(cls, forms):
+        """Creates GameData from a list of NewGameDataForms, writing them
+        with put_multi in chunks of IMPORT_CHUNK_SIZE. Every form is
+        checked before anything is written. Returns the keys.
+        Raises:
+            ValueError: if any form's hints do not hold MAX_HINTS hints."""
+        game_data = [GameData(sayer_category=form.sayer_category,
+                              sayer=form.sayer,
+                              saying=form.saying,
+                              hints=parse_hints(form.hints))
+                     for form in forms]
+        keys = []
+        for start in range(0, len(game_data), IMPORT_CHUNK_SIZE):
+            chunk = game_data[start:start + IMPORT_CHUNK_SIZE]
+            chunk_keys = ndb.put_multi(chunk)
+            by_category = collections.defaultdict(list)
+            for game_data in chunk:
+                _game_data_cache.delete(game_data.key)
+                by_category[game_data.sayer_category].append(game_data.key)
+            for sayer_category, category_keys in by_category.items():
+                cls.add_to_pool(sayer_category, category_keys)
+            keys.extend(chunk_keys)
+        return keys
+
+    def hint_list(self):
+        """Returns the hints as a list, splitting legacy joined strings."""
+        return split_hints(self.hints)
+
+    def is_legacy(self):
+        """True if the hints are still stored as a single joined string."""
+        return self.hint_list() != self.hints
+
+    @classmethod
+    def get_record(cls, key):
+        """Returns a GameDataRecord for key from the instance cache, fetching
+        and parsing the entity on a miss. Returns None if it does not
+        exist."""
+        return cls.get_record_async(key).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_record_async(cls, key):
+        """Tasklet version of get_record."""
+        record = _game_data_cache.get(key)
+        if record is None:
+            game_data = yield key.get_async()
+            if not game_data:
+                raise ndb.Return(None)
+            record = GameDataRecord(key=key,
+                                    sayer_category=game_data.sayer_category,
+                                    sayer=game_data.sayer,
+                                    saying=game_data.saying,
+                                    hints=tuple(game_data.hint_list()))
+            _game_data_cache.set(key, record)
+        raise ndb.Return(record)
+
+    @classmethod
+    def get_pool(cls, sayer_category):
+        """Returns the ids of all GameData in a category. The pool is held
+        in instance memory for GAME_DATA_POOL_TTL seconds and shared across
+        instances through memcache."""
+        expires, pool = _game_data_pools.get(sayer_category, (0, None))
+        if pool is None or expires < time.time():
+            memcache_key = MEMCACHE_GAME_DATA_POOL.format(sayer_category)
+            pool = memcache.get(memcache_key)
+            if pool is None:
+                pool = cls._query_pool(sayer_category)
+                memcache.add(memcache_key, pool,
+                             time=MEMCACHE_GAME_DATA_POOL_TTL)
+            _game_data_pools[sayer_category] = (
+                time.time() + GAME_DATA_POOL_TTL, pool)
+        return pool
+
+    @classmethod
+    def _query_pool(cls, sayer_category):
+        return [key.id() for key in cls.query(
+            cls.sayer_category == sayer_category).fetch(keys_only=True)]
+
+    @classmethod
+    def add_to_pool(cls, sayer_category, keys):
+        """Adds the keys of newly written GameData to a category pool. They
+        are added explicitly because a query issued right after the put
+        may not see the new entities yet. The memcache copy is updated with
+        compare-and-set so that concurrent imports do not drop each
+        other's keys; if that keeps failing it is deleted instead."""
+        ids = [key.id() for key in keys]
+        client = memcache.Client()
+        memcache_key = MEMCACHE_GAME_DATA_POOL.format(sayer_category)
+        for _ in range(POOL_CAS_RETRIES):
+            pool = client.gets(memcache_key)
+            if pool is None:
+                pool = cls._query_pool(sayer_category)
+                known = set(pool)
+                pool.extend(x for x in ids if x not in known)
+                if client.add(memcache_key, pool,
+                              time=MEMCACHE_GAME_DATA_POOL_TTL):
+                    break
+                continue
+            known = set(pool)
+            pool = pool + [x for x in ids if x not in known]
+            if client.cas(memcache_key, pool,
+                          time=MEMCACHE_GAME_DATA_POOL_TTL):
+                break
+        else:
+            memcache.delete(memcache_key)
+        _game_data_pools[sayer_category] = (
+            time.time() + GAME_DATA_POOL_TTL, pool)
+
+    @classmethod
+    def get_random(cls, sayer_category, exclude=()):
+        """Returns a GameDataRecord picked at random from a category,
+        preferring entries whose keys are not in exclude. Returns None for
+        an empty category."""
+        return cls.get_random_async(sayer_category, exclude).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_random_async(cls, sayer_category, exclude=()):
+        """Tasklet version of get_random."""
+        pool = cls.get_pool(sayer_category)
+        excluded = set(key.id() for key in exclude)
+        candidates = [x for x in pool if x not in excluded] or pool
+        if not candidates:
+            raise ndb.Return(None)
+        record = yield cls.get_record_async(
+            ndb.Key(cls, random.choice(candidates)))
+        raise ndb.Return(record)
+
 
 class NewGameDataForm(messages.Message):
     """Used to create new game data."""
@@ -61,6 +444,11 @@ class NewGameDataForm(messages.Message):
     hints = messages.StringField(4, required=True)
 
 
+class NewGameDataForms(messages.Message):
+    """Used to create game data in bulk."""
+    game_data = messages.MessageField(NewGameDataForm, 1, repeated=True)
+
+
 class SayerCategory(messages.Enum):
         ACTOR = 1
         SINGER = 2
@@ -75,6 +463,18 @@ class NewGameForm(messages.Message):
                                         required=True,
                                         default='ACTOR')
     num_hints = messages.IntegerField(3, required=True, default=0)
+    exclude_seen = messages.BooleanField(4, default=False)
+
+
+class NewGameForms(messages.Message):
+    """Used to create a batch of new games"""
+    games = messages.MessageField(NewGameForm, 1, repeated=True)
+
+
+# Entity groups allowed in one cross-group transaction.
+MAX_TRANSACTION_GROUPS = 25
+# Recent games checked for sayings a user has already seen.
+SEEN_GAMES_LIMIT = 500
 
 
 class Game(ndb.Model):
@@ -87,63 +487,116 @@ class Game(ndb.Model):
     num_hints = ndb.IntegerProperty(required=True)
     hints = ndb.StringProperty(repeated=True)
     points = ndb.IntegerProperty(required=True, default=85)
+    game_data = ndb.KeyProperty(kind='GameData')
+    rolled_up = ndb.BooleanProperty(default=False, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    ended = ndb.DateTimeProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
 
     @classmethod
-    def new_game(cls, user, sayer_category, num_hints):
-        """Creates and returns a new game"""
-        if num_hints < 0 or num_hints > 5:
-            raise ValueError('Number of hints must be between 0 and 5')
-        num_points = 85
-        if num_hints == 1:
-            num_points = 80
-        elif num_hints == 2:
-            num_points = 72
-        elif num_hints == 3:
-            num_points = 59
-        elif num_hints == 4:
-            num_points = 38
-        elif num_hints == 5:
-            num_points = 4
-        else:
-            num_points = 85
+    def new_game(cls, user, sayer_category, num_hints, exclude_seen=False):
+        """Creates and returns a new game. If exclude_seen is set, sayings
+        the user has already played are avoided while unseen ones remain.
+        Raises:
+            UserUnavailableError: if the User is being re-keyed."""
+        return cls.new_game_async(user, sayer_category, num_hints,
+                                  exclude_seen).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def pick_game_data_async(cls, user, sayer_category, exclude_seen=False):
+        """Returns a random GameDataRecord for a new game of user's. With
+        exclude_seen, only the user's SEEN_GAMES_LIMIT most recent games
+        count as seen, which bounds the query for prolific players."""
+        seen = set()
+        if exclude_seen:
+            games = yield cls.query(cls.user == user).order(
+                -cls.created).fetch_async(SEEN_GAMES_LIMIT,
+                                          projection=[cls.game_data])
+            seen = set(game.game_data for game in games)
+        game_data = yield GameData.get_random_async(sayer_category.name,
+                                                    exclude=seen)
+        raise ndb.Return(game_data)
 
-        game_data = GameData.query(
-            GameData.sayer_category == sayer_category.name).get()
+    @classmethod
+    @ndb.tasklet
+    def new_game_async(cls, user, sayer_category, num_hints,
+                       exclude_seen=False, game_data=None):
+        """Tasklet version of new_game. A GameDataRecord that was fetched
+        alongside the User may be passed in as game_data."""
+        game = yield cls.build_game_async(user, sayer_category, num_hints,
+                                          exclude_seen, game_data)
+        yield cls._start_games_async([game])
+        raise ndb.Return(game)
 
+    @classmethod
+    def start_games(cls, games):
+        """Writes a batch of new, unsaved Games and counts them in their
+        Users' stats, in cross-group transactions of at most
+        MAX_TRANSACTION_GROUPS entity groups. The transactions commit one
+        at a time, so a failure can leave the earlier ones written.
+        Raises:
+            UserUnavailableError: if a User is being re-keyed and no Game
+            was written.
+            BatchInterruptedError: if a User is being re-keyed and some
+            Games were already written."""
+        started = []
+        for chunk in chunk_by_groups(games, lambda game: game.user,
+                                     MAX_TRANSACTION_GROUPS):
+            try:
+                cls._start_games_async(chunk).get_result()
+            except UserUnavailableError as e:
+                if started:
+                    raise BatchInterruptedError(str(e), started)
+                raise
+            started.extend(chunk)
+
+    @classmethod
+    @ndb.transactional_tasklet(xg=True)
+    def _start_games_async(cls, games):
+        user_keys = list(set(game.user for game in games))
+        users = yield ndb.get_multi_async(user_keys)
+        users = dict(zip(user_keys, users))
+        for user in users.values():
+            User.check_writable(user)
+        for game in games:
+            users[game.user].count_new_game(game)
+        yield ndb.put_multi_async(list(games) + users.values())
+
+    @classmethod
+    @ndb.tasklet
+    def build_game_async(cls, user, sayer_category, num_hints,
+                         exclude_seen=False, game_data=None):
+        """Returns a new, unsaved Game, so that a batch of them can be
+        written together by start_games."""
+        num_points = points_for(num_hints)
+        if game_data is None:
+            game_data = yield cls.pick_game_data_async(user, sayer_category,
+                                                       exclude_seen)
         if not game_data:
             raise ValueError('sayer_category not found.')
-        else:
-            sayer = game_data.sayer
-            saying = game_data.saying
-
-            # parse hints into list and assign to game.hints
-            hintsStr = game_data.hints
-            hints = hintsStr.split('^^')
-            hintSentences = [
-                "The year it was said: %s.",
-                "The genre or industry in which it was said: %s.",
-                "The sayer's gender: %s.",
-                "The medium in which it was said: %s.",
-                "The sayer's initials: %s."
-            ]
-            userHints = []
-            for x in range(num_hints):
-                userHints.append(hintSentences[x] % hints[x])
         game = Game(user=user,
                     sayer_category=sayer_category.name,
-                    who_says=sayer,
-                    saying=saying,
+                    who_says=game_data.sayer,
+                    saying=game_data.saying,
                     points=num_points,
                     num_hints=num_hints,
-                    hints=userHints)
-        game.put()
-        return game
+                    hints=hint_sentences(game_data.hints, num_hints),
+                    game_data=game_data.key)
+        raise ndb.Return(game)
+
+    def _user_name(self, user_names):
+        """Returns the Game's user name, preferring a pre-resolved lookup
+        (see utils.get_user_names) over fetching the User entity."""
+        if user_names and self.user in user_names:
+            return user_names[self.user]
+        return self.user.get().name
 
-    def to_form(self, message):
+    def to_form(self, message, user_names=None):
         """Returns a GameForm representation of the Game"""
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.user_name = self._user_name(user_names)
         form.status = self.status
         form.saying = self.saying
         form.hints = ' '.join(self.hints)
@@ -151,32 +604,630 @@ class Game(ndb.Model):
         form.message = message
         return form
 
-    def to_score_report(self):
+    def to_score_report(self, user_names=None):
         form = ScoreReport()
-        form.user_name = self.user.get().name
+        form.user_name = self._user_name(user_names)
         form.status = self.status
         form.points = self.points
         return form
 
-    def to_game_analysis(self):
+    def to_game_analysis(self, user_names=None):
         form = GameAnalysis()
-        user = self.user.get()
-        form.user_name = user.name
+        form.user_name = self._user_name(user_names)
         form.sayer_category = self.sayer_category
         form.hints_purchased = self.num_hints
         form.game_status = self.status
         return form
 
-    @ndb.transactional(xg=True)
     def do_move(self):
-        self.status = 'WON'
-        self.put()
+        """Records a win. Returns the updated User, or None if the game
+        was already over.
+        Raises:
+            UserUnavailableError: if the User is being re-keyed."""
+        return self.do_move_async().get_result()
 
-        user = self.user.get()
+    @ndb.transactional_tasklet(xg=True)
+    def do_move_async(self):
+        """Tasklet version of do_move. The game, User and points shard are
+        read together, then all writes and task enqueues are issued at
+        once. The caller schedules the average game points refresh once
+        the transaction has committed."""
+        current, user, shard = yield (
+            self.key.get_async(), self.user.get_async(),
+            GamePointsShard.get_random_shard_async())
+        if not current or current.status != 'NEW':
+            raise ndb.Return(None)
+        User.check_writable(user)
+        self.status = 'WON'
+        self.ended = datetime.datetime.utcnow()
         user.points_earned += self.points
-        user.put()
+        user.count_finished_game(self)
+        shard.add_win(self.points)
+
+        tasks = [taskqueue.Task(url='/tasks/update_leaderboard',
+                                params={'name': user.name}),
+                 self._record_result_task()]
+        yield (self.put_async(),
+               user.put_async(),
+               shard.put_async(),
+               add_tasks_async(tasks, transactional=True))
+        raise ndb.Return(user)
 
-        taskqueue.add(url='/tasks/cache_average_game_points')
+    def end_game(self, status):
+        """Ends a game that was not won, with status LOST or CANCELLED.
+        Returns the updated User, or None if the game was already over.
+        Raises:
+            UserUnavailableError: if the User is being re-keyed."""
+        return self.end_game_async(status).get_result()
+
+    @ndb.transactional_tasklet(xg=True)
+    def end_game_async(self, status):
+        """Tasklet version of end_game."""
+        current, user = yield self.key.get_async(), self.user.get_async()
+        if not current or current.status != 'NEW':
+            raise ndb.Return(None)
+        User.check_writable(user)
+        self.status = status
+        self.ended = datetime.datetime.utcnow()
+        user.count_finished_game(self)
+        yield (self.put_async(),
+               user.put_async(),
+               add_tasks_async(self._record_result_task(),
+                               transactional=True))
+        raise ndb.Return(user)
+
+    @classmethod
+    def settle_moves(cls, moves):
+        """Applies a batch of guesses, winning or losing each game.
+        Games are settled in cross-group transactions of at most
+        MAX_TRANSACTION_GROUPS entity groups. Each transaction writes its
+        games with one put_multi, each of their Users and a single points
+        shard once, and enqueues one leaderboard and one game result task
+        for all of them.
+        Args:
+            moves: A list of (Game, guess) pairs
+        Returns:
+            A dict mapping the key of each game that was settled to its
+            Game after the move. Games that were already over or expired
+            by the time their transaction ran, or whose User is being
+            re-keyed, are left out."""
+        games = {}
+        # Each transaction also holds one points shard.
+        for chunk in chunk_by_groups(moves, lambda move: move[0].user,
+                                     MAX_TRANSACTION_GROUPS, 1):
+            games.update(cls._settle_chunk(
+                [(game.key, guess) for game, guess in chunk]))
+        return games
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _settle_chunk(cls, moves):
+        games = ndb.get_multi([game_key for game_key, _ in moves])
+        # Games expired since the caller fetched them are gone.
+        user_keys = list(set(game.user for game in games if game))
+        users = dict(zip(user_keys, ndb.get_multi(user_keys)))
+        # Games of Users being re-keyed are left NEW.
+        users = dict((key, user) for key, user in users.items()
+                     if user and not user.rekeying)
+        old_points = dict((key, user.points_earned)
+                          for key, user in users.items())
+        shard = GamePointsShard.get_random_shard_async().get_result()
+
+        now = datetime.datetime.utcnow()
+        settled = []
+        for game, (_, guess) in zip(games, moves):
+            if not game or game.status != 'NEW' or game.user not in users:
+                continue
+            game.ended = now
+            game.status = game_rules.outcome(game.who_says, guess)
+            if game.status == 'WON':
+                users[game.user].points_earned += game.points
+                shard.add_win(game.points)
+            users[game.user].count_finished_game(game)
+            settled.append(game)
+        if not settled:
+            return {}
+
+        changed = [user for key, user in users.items()
+                   if user.points_earned != old_points[key]]
+        tasks = [taskqueue.Task(url='/tasks/record_game_result',
+                                params={'game': [game.key.urlsafe()
+                                                 for game in settled]})]
+        entities = list(settled)
+        entities.extend(users[key]
+                        for key in set(game.user for game in settled))
+        if changed:
+            entities.append(shard)
+            tasks.append(taskqueue.Task(
+                url='/tasks/update_leaderboard',
+                params={'name': [user.name for user in changed]}))
+        ndb.put_multi(entities)
+        taskqueue.Queue().add(tasks, transactional=True)
+        return dict((game.key, game) for game in settled)
+
+    @classmethod
+    def expire(cls, games, cutoff):
+        """Deletes the games that are still NEW and were created before
+        cutoff, and takes them back out of their Users' stats, in
+        cross-group transactions of at most MAX_TRANSACTION_GROUPS entity
+        groups. Expired games were never played, so they do not count.
+        Args:
+            games: The candidate Games, e.g. from a query
+        Returns:
+            The deleted Games."""
+        expired = []
+        for chunk in chunk_by_groups(games, lambda game: game.user,
+                                     MAX_TRANSACTION_GROUPS):
+            expired.extend(cls._expire_chunk(
+                [game.key for game in chunk], cutoff))
+        return expired
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _expire_chunk(cls, game_keys, cutoff):
+        games = [game for game in ndb.get_multi(game_keys)
+                 if game and game.status == 'NEW' and game.created and
+                 game.created < cutoff]
+        if not games:
+            return []
+        users = [user for user in ndb.get_multi(
+            list(set(game.user for game in games))) if user]
+        by_key = dict((user.key, user) for user in users)
+        for game in games:
+            if game.user in by_key:
+                by_key[game.user].uncount_new_game(game)
+        ndb.put_multi(users)
+        ndb.delete_multi([game.key for game in games])
+        return games
+
+    def _record_result_task(self):
+        """Returns the task that folds this finished game into the
+        GameRollups. It must be added transactionally with the write that
+        ended the game."""
+        return taskqueue.Task(url='/tasks/record_game_result',
+                              params={'game': self.key.urlsafe()})
+
+
+NUM_POINTS_SHARDS = 20
+
+
+class GamePointsShard(ndb.Model):
+    """Shard of the running total of points won across all WON games.
+    Spreading the total over several entities keeps concurrent wins from
+    contending on a single entity group."""
+    total_points = ndb.IntegerProperty(default=0, indexed=False)
+    games_won = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def _shard_keys(cls):
+        return [ndb.Key(cls, 'shard-{}'.format(i))
+                for i in range(NUM_POINTS_SHARDS)]
+
+    @classmethod
+    @ndb.tasklet
+    def get_random_shard_async(cls):
+        """Returns a random shard, which is new if it was never written.
+        Intended to be called inside the transaction that records a win."""
+        key = random.choice(cls._shard_keys())
+        shard = yield key.get_async()
+        raise ndb.Return(shard or cls(key=key))
+
+    def add_win(self, points):
+        self.total_points += points
+        self.games_won += 1
+
+    @classmethod
+    def get_average(cls):
+        """Returns the average points per won game, or None if no game
+        has been won yet."""
+        shards = [shard for shard in ndb.get_multi(cls._shard_keys())
+                  if shard]
+        games_won = sum(shard.games_won for shard in shards)
+        if not games_won:
+            return None
+        total_points = sum(shard.total_points for shard in shards)
+        return float(total_points) / games_won
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes the aggregate from the WON games and overwrites the
+        shards. Wins recorded while the scan is running may be missed
+        until the next rebuild."""
+        total_points = 0
+        games_won = 0
+        for game in itertools.chain(
+                Game.query(Game.status == 'WON', projection=[Game.points]),
+                GameHistory.archived_games('WON')):
+            total_points += game.points
+            games_won += 1
+        shards = [cls(key=key) for key in cls._shard_keys()]
+        shards[0].total_points = total_points
+        shards[0].games_won = games_won
+        ndb.put_multi(shards)
+
+
+HIGH_SCORE_TABLE_SIZE = 100
+
+
+class HighScoreEntry(ndb.Model):
+    """One won game in the HighScoreTable."""
+    points = ndb.IntegerProperty(required=True)
+    ended = ndb.DateTimeProperty()
+    user_name = ndb.StringProperty(required=True)
+    game = ndb.KeyProperty(kind='Game', required=True)
+
+    def sort_key(self):
+        """Orders by points, then earliest win first, then game key, so
+        tied scores always come out in the same order."""
+        return (-self.points, self.ended or datetime.datetime.min,
+                self.game.urlsafe())
+
+    def to_score_report(self):
+        return ScoreReport(user_name=self.user_name,
+                           status='WON',
+                           points=self.points)
+
+
+class HighScoreTable(ndb.Model):
+    """The top HIGH_SCORE_TABLE_SIZE won games, kept in order in a single
+    entity so that the top scores are one key get."""
+    entries = ndb.LocalStructuredProperty(HighScoreEntry, repeated=True)
+
+    @classmethod
+    def get_table(cls):
+        key = ndb.Key(cls, 'top')
+        return key.get() or cls(key=key)
+
+    @classmethod
+    def record_win(cls, game, user_name):
+        """Adds a won game to the table if it places. Returns True if the
+        table changed."""
+        entry = HighScoreEntry(points=game.points,
+                               ended=game.ended,
+                               user_name=user_name,
+                               game=game.key)
+        if not cls.get_table()._places(entry):
+            return False
+
+        @ndb.transactional
+        def _insert():
+            table = cls.get_table()
+            if not table._places(entry):
+                return False
+            keys = [existing.sort_key() for existing in table.entries]
+            table.entries.insert(bisect.bisect(keys, entry.sort_key()),
+                                 entry)
+            del table.entries[HIGH_SCORE_TABLE_SIZE:]
+            table.put()
+            return True
+        return _insert()
+
+    def _places(self, entry):
+        if any(existing.game == entry.game for existing in self.entries):
+            return False
+        return (len(self.entries) < HIGH_SCORE_TABLE_SIZE or
+                entry.sort_key() < self.entries[-1].sort_key())
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes the table from the WON games. Reads down the points
+        index until the table is full and every game tied with the last
+        place has been seen, so ties are ordered the same way as on
+        insert, then adds any archived win that could place."""
+        games = []
+        for game in Game.query(Game.status == 'WON').order(-Game.points):
+            if (len(games) >= HIGH_SCORE_TABLE_SIZE and
+                    game.points < games[HIGH_SCORE_TABLE_SIZE - 1].points):
+                break
+            games.append(game)
+        lowest = (games[HIGH_SCORE_TABLE_SIZE - 1].points
+                  if len(games) >= HIGH_SCORE_TABLE_SIZE else None)
+        games.extend(game for game in GameHistory.archived_games('WON')
+                     if lowest is None or game.points >= lowest)
+        user_names = get_user_names(games)
+        entries = [HighScoreEntry(points=game.points,
+                                  ended=game.ended,
+                                  user_name=user_names.get(game.user, ''),
+                                  game=game.key)
+                   for game in games]
+        entries.sort(key=HighScoreEntry.sort_key)
+        cls(key=ndb.Key(cls, 'top'),
+            entries=entries[:HIGH_SCORE_TABLE_SIZE]).put()
+
+
+NUM_ROLLUP_SHARDS = 10
+
+
+class GameRollup(ndb.Model):
+    """Running totals of finished games, either for one sayer_category and
+    num_hints combination or for one User. Each combination is split over
+    NUM_ROLLUP_SHARDS entities so that concurrent games do not contend on
+    one entity group; get_choice_rollups sums them."""
+    dimension = ndb.StringProperty(required=True, choices=['choice', 'user'])
+    sayer_category = ndb.StringProperty()
+    num_hints = ndb.IntegerProperty()
+    user = ndb.KeyProperty(kind='User')
+    games_won = ndb.IntegerProperty(default=0, indexed=False)
+    games_lost = ndb.IntegerProperty(default=0, indexed=False)
+    games_cancelled = ndb.IntegerProperty(default=0, indexed=False)
+    points_won = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def choice_key(cls, sayer_category, num_hints, shard=0):
+        # Shard 0 keeps the key used before the rollups were sharded.
+        name = 'choice:{}:{}'.format(sayer_category, num_hints)
+        if shard:
+            name += ':{}'.format(shard)
+        return ndb.Key(cls, name)
+
+    @classmethod
+    def user_key(cls, user_key):
+        return ndb.Key(cls, u'user:{}'.format(user_key.id()))
+
+    @classmethod
+    def _rollups_for(cls, game, existing, shard=0):
+        """Returns the choice rollup shard and user rollup for a game,
+        creating them in existing (a key -> GameRollup dict) as needed."""
+        choice_key = cls.choice_key(game.sayer_category, game.num_hints,
+                                    shard)
+        if not existing.get(choice_key):
+            existing[choice_key] = cls(key=choice_key,
+                                       dimension='choice',
+                                       sayer_category=game.sayer_category,
+                                       num_hints=game.num_hints)
+        user_key = cls.user_key(game.user)
+        if not existing.get(user_key):
+            existing[user_key] = cls(key=user_key,
+                                     dimension='user',
+                                     user=game.user)
+        return existing[choice_key], existing[user_key]
+
+    def add_rollup(self, other):
+        self.games_won += other.games_won
+        self.games_lost += other.games_lost
+        self.games_cancelled += other.games_cancelled
+        self.points_won += other.points_won
+
+    def add_game(self, game):
+        if game.status == 'WON':
+            self.games_won += 1
+            self.points_won += game.points
+        elif game.status == 'LOST':
+            self.games_lost += 1
+        elif game.status == 'CANCELLED':
+            self.games_cancelled += 1
+
+    @classmethod
+    def record_game(cls, game_key):
+        """Adds a finished game to its user rollup and to a random shard of
+        its choice rollup. Games are flagged once recorded, so a retried
+        task does not count them twice."""
+        shard = random.randrange(NUM_ROLLUP_SHARDS)
+
+        @ndb.transactional(xg=True)
+        def _record():
+            game = game_key.get()
+            if not game or game.rolled_up or game.status == 'NEW':
+                return
+            keys = [cls.choice_key(game.sayer_category, game.num_hints,
+                                   shard),
+                    cls.user_key(game.user)]
+            existing = dict(zip(keys, ndb.get_multi(keys)))
+            rollups = cls._rollups_for(game, existing, shard)
+            for rollup in rollups:
+                rollup.add_game(game)
+            game.rolled_up = True
+            ndb.put_multi(list(rollups) + [game])
+        _record()
+
+    @classmethod
+    def get_choice_rollups(cls):
+        """Returns one unsaved GameRollup per sayer_category and num_hints
+        combination with finished games, summed over its shards."""
+        keys = [cls.choice_key(category.name, num_hints, shard)
+                for category in SayerCategory
+                for num_hints in range(MAX_HINTS + 1)
+                for shard in range(NUM_ROLLUP_SHARDS)]
+        totals = collections.OrderedDict()
+        for rollup in ndb.get_multi(keys):
+            if not rollup:
+                continue
+            choice = (rollup.sayer_category, rollup.num_hints)
+            if choice not in totals:
+                totals[choice] = cls(dimension='choice',
+                                     sayer_category=rollup.sayer_category,
+                                     num_hints=rollup.num_hints)
+            totals[choice].add_rollup(rollup)
+        return totals.values()
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every rollup from the games already flagged as
+        recorded, archived games included, into shard 0 of each choice
+        rollup. Games whose record task is still pending are added by that
+        task."""
+        rollups = {}
+        for game in itertools.chain(Game.query(),
+                                    GameHistory.archived_games()):
+            if game.rolled_up:
+                for rollup in cls._rollups_for(game, rollups):
+                    rollup.add_game(game)
+        ndb.delete_multi([key for key in cls.query().iter(keys_only=True)
+                          if key not in rollups])
+        ndb.put_multi(rollups.values())
+
+    def to_form(self, user_name=None):
+        form = GameRollupForm()
+        form.sayer_category = self.sayer_category
+        form.num_hints = self.num_hints
+        form.user_name = user_name
+        form.games_won = self.games_won
+        form.games_lost = self.games_lost
+        form.games_cancelled = self.games_cancelled
+        games_finished = self.games_won + self.games_lost
+        if games_finished:
+            form.win_rate = float(self.games_won) / games_finished
+        if self.games_won:
+            form.average_points = float(self.points_won) / self.games_won
+        return form
+
+
+STALE_GAME_AGE = datetime.timedelta(days=30)
+ARCHIVE_GAME_AGE = datetime.timedelta(days=90)
+HISTORY_CHUNK_SIZE = 2000
+
+
+class GameHistory(ndb.Model):
+    """Finished games archived out of the Game kind, packed into parallel
+    arrays. A User's history is split into chunks numbered from 1, each a
+    child of the User holding up to HISTORY_CHUNK_SIZE games, so that the
+    nth archived game is always in chunk n // HISTORY_CHUNK_SIZE + 1."""
+    game_ids = ndb.IntegerProperty(repeated=True, indexed=False)
+    sayer_categories = ndb.StringProperty(repeated=True, indexed=False)
+    num_hints = ndb.IntegerProperty(repeated=True, indexed=False)
+    statuses = ndb.StringProperty(repeated=True, indexed=False)
+    points = ndb.IntegerProperty(repeated=True, indexed=False)
+    ended = ndb.DateTimeProperty(repeated=True, indexed=False)
+
+    @classmethod
+    def chunk_key(cls, user_key, number):
+        return ndb.Key(cls, number, parent=user_key)
+
+    @classmethod
+    def archive(cls, user_key, game_keys, cutoff):
+        """Moves one User's games that ended before cutoff into the User's
+        history and deletes them, in one transaction. Games that are gone,
+        still NEW or not yet in the rollups, or whose User is being
+        re-keyed, are left alone. At most MAX_TRANSACTION_GROUPS - 1 keys
+        may be passed.
+        Returns the archived Games."""
+        @ndb.transactional(xg=True)
+        def _archive():
+            user = user_key.get()
+            if not user or user.rekeying:
+                # MigrateUsers is moving the history to a new key.
+                return []
+            games = [game for game in ndb.get_multi(game_keys)
+                     if game and game.status != 'NEW' and game.rolled_up and
+                     game.ended and game.ended < cutoff]
+            if not games:
+                return []
+            numbers = [key.id() for key in
+                       cls.query(ancestor=user_key).iter(keys_only=True)]
+            chunk = (cls.chunk_key(user_key, max(numbers)).get() if numbers
+                     else cls(key=cls.chunk_key(user_key, 1)))
+            chunks = [chunk]
+            for game in games:
+                if len(chunk.game_ids) >= HISTORY_CHUNK_SIZE:
+                    chunk = cls(key=cls.chunk_key(user_key,
+                                                  chunk.key.id() + 1))
+                    chunks.append(chunk)
+                chunk.game_ids.append(game.key.id())
+                chunk.sayer_categories.append(game.sayer_category)
+                chunk.num_hints.append(game.num_hints)
+                chunk.statuses.append(game.status)
+                chunk.points.append(game.points)
+                chunk.ended.append(game.ended)
+            ndb.put_multi(chunks)
+            ndb.delete_multi([game.key for game in games])
+            return games
+        return _archive()
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def move(cls, old_user_key, new_user_key):
+        """Moves a User's history chunks under another User key, keeping
+        their numbers. Used when a User is re-keyed."""
+        chunks = cls.query(ancestor=old_user_key).fetch()
+        ndb.put_multi([cls(key=cls.chunk_key(new_user_key, chunk.key.id()),
+                           **chunk.to_dict()) for chunk in chunks])
+        ndb.delete_multi([chunk.key for chunk in chunks])
+
+    def games(self):
+        """Returns the archived games as unsaved Game entities with only
+        the fields kept in the history set."""
+        user_key = self.key.parent()
+        return [Game(key=ndb.Key(Game, game_id),
+                     user=user_key,
+                     sayer_category=sayer_category,
+                     num_hints=num_hints,
+                     status=status,
+                     points=points,
+                     ended=ended,
+                     rolled_up=True)
+                for game_id, sayer_category, num_hints, status, points, ended
+                in zip(self.game_ids, self.sayer_categories, self.num_hints,
+                       self.statuses, self.points, self.ended)]
+
+    @classmethod
+    def archived_games(cls, status=None):
+        """Yields every archived game, optionally only those with status,
+        for the rebuilds that scan all finished games."""
+        for history in cls.query():
+            for game in history.games():
+                if status is None or game.status == status:
+                    yield game
+
+    @classmethod
+    def get_score_page(cls, user_key, user_name, offset, page_size):
+        """Returns a page of a User's archived game scores.
+        Args:
+            user_key: The User's key
+            user_name: The User's name, for the ScoreReports
+            offset: The number of archived games before the page
+            page_size: The maximum number of scores to return
+        Returns:
+            A (scores, next_offset) tuple. next_offset is None when there
+            are no more archived games."""
+        scores = []
+        number = offset // HISTORY_CHUNK_SIZE + 1
+        start = offset % HISTORY_CHUNK_SIZE
+        while len(scores) < page_size:
+            chunk = cls.chunk_key(user_key, number).get()
+            if not chunk:
+                return scores, None
+            end = start + page_size - len(scores)
+            scores.extend(ScoreReport(user_name=user_name,
+                                      status=status,
+                                      points=points)
+                          for status, points in zip(chunk.statuses[start:end],
+                                                    chunk.points[start:end]))
+            if end < len(chunk.game_ids):
+                break
+            number += 1
+            start = 0
+        return scores, offset + len(scores)
+
+
+class ExportJob(ndb.Model):
+    """Progress of one run of export.py. Records which kind is being
+    exported and the cursor and number of the next batch."""
+    incremental = ndb.BooleanProperty(default=False, indexed=False)
+    since = ndb.DateTimeProperty(indexed=False)
+    bucket = ndb.StringProperty(required=True, indexed=False)
+    kind_index = ndb.IntegerProperty(default=0, indexed=False)
+    batch = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    completed = ndb.BooleanProperty(default=False)
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    finished = ndb.DateTimeProperty(indexed=False)
+
+
+class GameRollupForm(messages.Message):
+    """GameRollupForm for outbound aggregate game results."""
+    sayer_category = messages.StringField(1)
+    num_hints = messages.IntegerField(2)
+    user_name = messages.StringField(3)
+    games_won = messages.IntegerField(4, required=True)
+    games_lost = messages.IntegerField(5, required=True)
+    games_cancelled = messages.IntegerField(6, required=True)
+    win_rate = messages.FloatField(7)
+    average_points = messages.FloatField(8)
+
+
+class GameRollupForms(messages.Message):
+    """Return multiple GameRollupForms."""
+    rollups = messages.MessageField(GameRollupForm, 1, repeated=True)
 
 
 class GameAnalysis(messages.Message):
@@ -190,6 +1241,7 @@ class GameAnalysis(messages.Message):
 class Analysis(messages.Message):
     """Return game analysis."""
     analysis = messages.MessageField(GameAnalysis, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class GameForm(messages.Message):
@@ -208,6 +1260,17 @@ class MakeMoveForm(messages.Message):
     guess = messages.StringField(1, required=True)
 
 
+class MoveForm(messages.Message):
+    """Used to take a guess in one game of a batch."""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    guess = messages.StringField(2, required=True)
+
+
+class MoveForms(messages.Message):
+    """Used to take guesses in a batch of games."""
+    moves = messages.MessageField(MoveForm, 1, repeated=True)
+
+
 class ScoreReport(messages.Message):
     """ScoreReport for outbound Score information."""
     user_name = messages.StringField(1, required=True)
@@ -218,13 +1281,16 @@ class ScoreReport(messages.Message):
 class GameHighScores(messages.Message):
     """Return multiple ScoreReports."""
     high_scores = messages.MessageField(ScoreReport, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms."""
     scores = messages.MessageField(ScoreReport, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class GameForms(messages.Message):
     """Return multiple GameForms."""
     games = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
@@ -0,0 +1,53 @@
+"""refresh.py - Coalesced refreshes of derived data.
+
+A write that leaves derived data to be recomputed calls schedule() with the
+name of its refresh instead of enqueuing a recomputation of its own. Every
+call within one interval of the refresh shares a single named task that
+runs at the end of the interval, so the refresh runs at most once per
+interval however many writes there are.
+
+Refreshes are registered by the module that defines them, which must be
+imported wherever they are scheduled or run."""
+
+import logging
+import time
+
+from google.appengine.api import taskqueue
+
+# refresh name -> (interval in seconds, function)
+_refreshes = {}
+
+
+def register(name, interval, function):
+    """Registers a refresh.
+    Args:
+        name: The refresh name, made of letters, digits, '_' and '-'
+        interval: The most often in seconds the refresh will run
+        function: A callable taking no arguments that does the refresh"""
+    _refreshes[name] = (interval, function)
+
+
+def schedule(name):
+    """Makes sure the refresh runs at the end of the current interval.
+    Named tasks cannot be added transactionally, so call this after the
+    write that made the refresh necessary has been committed."""
+    interval = _refreshes[name][0]
+    now = time.time()
+    window = int(now // interval)
+    try:
+        taskqueue.add(url='/tasks/refresh',
+                      name='refresh-{}-{}'.format(name, window),
+                      params={'name': name},
+                      countdown=(window + 1) * interval - now)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def run(name):
+    """Runs a registered refresh. Returns False if there is none by that
+    name."""
+    if name not in _refreshes:
+        logging.warning('No refresh named %s is registered.', name)
+        return False
+    _refreshes[name][1]()
+    return True
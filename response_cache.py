@@ -0,0 +1,111 @@
+"""response_cache.py - Read-through memcache cache for endpoint responses.
+
+A cached response is keyed by the endpoint, its request and the current
+version of every scope it was built from (a game, a user, or all scores).
+Writes bump the versions of the scopes they touch, which makes every
+response built from the old state unreachable rather than stale.
+
+A lease keeps concurrent misses for the same response from all rebuilding
+it. Once a response is older than its ttl, the lease holder rebuilds it
+while everyone else keeps being served the previous response for the
+same versions."""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from protorpc import protojson
+
+SCORES_SCOPE = 'scores'
+VERSION_KEY = u'RESPONSE_VERSION_{}'
+DEFAULT_TTL = 60
+STALE_TTL = 600
+LEASE_SECONDS = 10
+LEASE_POLLS = 5
+LEASE_POLL_INTERVAL = 0.05
+
+
+def game_scope(urlsafe_game_key):
+    return u'game:{}'.format(urlsafe_game_key)
+
+
+def user_scope(user_key):
+    return u'user:{}'.format(user_key.id())
+
+
+def _initial_version():
+    # Versions start from the clock so that one evicted from memcache
+    # never comes back as a version that cached responses were built at.
+    return int(time.time() * 1000)
+
+
+def get_versions(scopes):
+    """Returns the current version of each scope, in order."""
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = memcache.get_multi(keys)
+    missing = dict((key, _initial_version()) for key in keys
+                   if key not in versions)
+    if missing:
+        memcache.add_multi(missing)
+        versions.update(memcache.get_multi(missing.keys()))
+        for key, version in missing.items():
+            versions.setdefault(key, version)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Invalidates every cached response built from any of the scopes.
+    Call after the write to those scopes has been committed."""
+    memcache.offset_multi(
+        dict((VERSION_KEY.format(scope), 1) for scope in scopes),
+        initial_value=_initial_version())
+
+
+def _cache_key(name, request, scopes):
+    parts = [name, protojson.encode_message(request) if request else '']
+    parts.extend(u'{}={}'.format(scope, version) for scope, version
+                 in zip(scopes, get_versions(scopes)))
+    digest = hashlib.sha1(u'|'.join(parts).encode('utf-8')).hexdigest()
+    return 'RESPONSE_{}_{}'.format(name, digest)
+
+
+def read_through(name, request, scopes, response_type, build,
+                 ttl=DEFAULT_TTL):
+    """Returns the cached response for an endpoint request, calling build()
+    to create it on a miss.
+    Args:
+        name: The endpoint method name
+        request: The request message, or None if it takes no parameters
+        scopes: The scopes the response is built from
+        response_type: The protorpc Message class of the response
+        build: A callable returning the response
+        ttl: Seconds before a cached response is rebuilt
+    Returns:
+        An instance of response_type."""
+    key = _cache_key(name, request, scopes)
+    lease_key = key + '_LEASE'
+    cached = memcache.get(key)
+    if cached and cached[0] > time.time():
+        return protojson.decode_message(response_type, cached[1])
+
+    leased = memcache.add(lease_key, 1, time=LEASE_SECONDS)
+    if not leased:
+        if cached:
+            return protojson.decode_message(response_type, cached[1])
+        # Another request is building this response; give it a moment
+        # before building it here as well.
+        for _ in range(LEASE_POLLS):
+            time.sleep(LEASE_POLL_INTERVAL)
+            cached = memcache.get(key)
+            if cached:
+                return protojson.decode_message(response_type, cached[1])
+
+    try:
+        response = build()
+        memcache.set(key,
+                     (time.time() + ttl, protojson.encode_message(response)),
+                     time=ttl + STALE_TTL)
+    finally:
+        if leased:
+            memcache.delete(lease_key)
+    return response
@@ -0,0 +1,33 @@
+"""score_tree.py - Node arithmetic for the hierarchical score histogram
+kept by leaderboard.py. Free of App Engine imports so that it can be
+tested in any Python process.
+
+Level 0 has one node per points value. Each node of level k + 1 covers
+BRANCHING consecutive nodes of level k, so node i of level k counts the
+Users whose points fall in [i * BRANCHING ** k, (i + 1) * BRANCHING ** k).
+TOP_LEVEL is the widest level stored."""
+
+BRANCHING = 16
+TOP_LEVEL = 4
+
+
+def nodes_for(points):
+    """Returns the (level, index) of every node that counts a User with
+    points, one per level."""
+    return [(level, points // BRANCHING ** level)
+            for level in range(TOP_LEVEL + 1)]
+
+
+def nodes_above(points):
+    """Returns the nodes that together count every User with more than
+    points exactly once.
+    Returns:
+        A (nodes, top_index) tuple. nodes is a list of (level, index) below
+        TOP_LEVEL, at most BRANCHING - 1 per level. The TOP_LEVEL nodes
+        with an index above top_index complete the count."""
+    nodes = []
+    for level in range(TOP_LEVEL):
+        index = points // BRANCHING ** level
+        end = (index // BRANCHING + 1) * BRANCHING
+        nodes.extend((level, sibling) for sibling in range(index + 1, end))
+    return nodes, points // BRANCHING ** TOP_LEVEL
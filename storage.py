@@ -0,0 +1,650 @@
+"""storage.py - Storage backends and repositories for users, games and game
+data.
+
+The repositories hold the storage side of playing the game: creating and
+looking up users, adding and picking game data, and creating, playing and
+listing games. They work on plain dict records through a Backend, so the
+same code runs on the datastore (NdbBackend), in memory (MemoryBackend) or
+on SQLite (SqliteBackend), the last two in any Python process without the
+App Engine SDK.
+
+A record is a dict of JSON-compatible values with the properties of the
+matching models.py entity, plus its id under 'id'. Ids are strings chosen
+by the backend; NdbBackend uses urlsafe keys. References between records,
+such as a game's user and game_data, hold ids, and datetimes are ISO 8601
+strings.
+
+Every backend has batch get, put and delete, queries with equality filters
+and at most one sort order that are paged with cursor strings, and
+transactions. The datastore-only aggregates (points shards, leaderboard,
+rollups and high scores) are kept by the endpoints in whosays_api.py and
+are not updated here, which is why NdbBackend does not write games."""
+
+import base64
+import collections
+import copy
+import datetime
+import json
+import random
+import sqlite3
+import threading
+import uuid
+
+import game_rules
+
+DEFAULT_PAGE_SIZE = 20
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# The properties SqliteBackend can filter and order on, by kind.
+INDEXED_PROPERTIES = {
+    'User': ['name', 'points_earned'],
+    'Game': ['user', 'status', 'points', 'sayer_category'],
+    'GameData': ['sayer_category'],
+}
+# SQLite allows at most 999 parameters per statement.
+SQLITE_BATCH_SIZE = 500
+# Kinds NdbBackend refuses to write; see NdbBackend.
+READ_ONLY_NDB_KINDS = ('Game',)
+
+
+class WriteNotAllowed(Exception):
+    """Raised by a backend asked to write a kind it only reads."""
+
+
+class UserUnavailableError(Exception):
+    """Raised by GameRepository writes to a user record that does not exist
+    or is being re-keyed, as models.User.check_writable does."""
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime(DATETIME_FORMAT)
+
+
+def _parse_order(order):
+    """Returns (property, descending) for an order such as '-points'."""
+    if not order:
+        return None, False
+    if order.startswith('-'):
+        return order[1:], True
+    return order, False
+
+
+def _encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position))
+
+
+def _decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+class Backend(object):
+    """The operations every storage backend provides."""
+
+    def make_id(self, kind, name):
+        """Returns the id of the record of kind named name, for records
+        such as users that are keyed by a natural name."""
+        raise NotImplementedError
+
+    def get_multi(self, kind, ids):
+        """Returns the records with the given ids, in order, with None for
+        ids that have no record."""
+        raise NotImplementedError
+
+    def put_multi(self, kind, records):
+        """Writes records, giving an id to each one that has none.
+        Returns the ids, in order."""
+        raise NotImplementedError
+
+    def delete_multi(self, kind, ids):
+        raise NotImplementedError
+
+    def query(self, kind, filters=(), order=None,
+              page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Returns one page of the records matching every (property, value)
+        equality filter, sorted by order, a property name that may be
+        prefixed with '-' for descending order.
+        Returns:
+            A (records, next_cursor) tuple. next_cursor is None when there
+            are no more records."""
+        raise NotImplementedError
+
+    def transaction(self, function):
+        """Runs function in a transaction and returns its result."""
+        raise NotImplementedError
+
+
+class MemoryBackend(Backend):
+    """Keeps records in dicts in this process. Transactions are serialized
+    by a lock and undone if the function raises."""
+
+    def __init__(self):
+        self._kinds = collections.defaultdict(dict)
+        self._lock = threading.RLock()
+        self._journal = None
+
+    def make_id(self, kind, name):
+        return name
+
+    def get_multi(self, kind, ids):
+        with self._lock:
+            records = self._kinds[kind]
+            return [copy.deepcopy(records.get(record_id))
+                    for record_id in ids]
+
+    def _set(self, kind, record_id, record):
+        records = self._kinds[kind]
+        if self._journal is not None:
+            self._journal.append((kind, record_id, records.get(record_id)))
+        if record is None:
+            records.pop(record_id, None)
+        else:
+            records[record_id] = record
+
+    def put_multi(self, kind, records):
+        with self._lock:
+            for record in records:
+                if not record.get('id'):
+                    record['id'] = uuid.uuid4().hex
+                self._set(kind, record['id'], copy.deepcopy(record))
+            return [record['id'] for record in records]
+
+    def delete_multi(self, kind, ids):
+        with self._lock:
+            for record_id in ids:
+                self._set(kind, record_id, None)
+
+    def query(self, kind, filters=(), order=None,
+              page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        prop, descending = _parse_order(order)
+
+        def position(record):
+            return [record.get(prop) if prop else None, record['id']]
+
+        with self._lock:
+            matches = [record for record in self._kinds[kind].values()
+                       if all(record.get(name) == value
+                              for name, value in filters)]
+            matches.sort(key=position, reverse=descending)
+            if cursor:
+                last = _decode_cursor(cursor)
+                matches = [record for record in matches
+                           if (position(record) < last if descending
+                               else position(record) > last)]
+            page = [copy.deepcopy(record) for record in matches[:page_size]]
+        next_cursor = None
+        if len(matches) > page_size:
+            next_cursor = _encode_cursor(position(page[-1]))
+        return page, next_cursor
+
+    def transaction(self, function):
+        with self._lock:
+            if self._journal is not None:
+                return function()
+            self._journal = []
+            try:
+                result = function()
+            except Exception:
+                for kind, record_id, record in reversed(self._journal):
+                    if record is None:
+                        self._kinds[kind].pop(record_id, None)
+                    else:
+                        self._kinds[kind][record_id] = record
+                raise
+            finally:
+                self._journal = None
+            return result
+
+
+class SqliteBackend(Backend):
+    """Keeps records in SQLite. Each kind is a table of ids and JSON
+    documents with an indexed column for each of its INDEXED_PROPERTIES,
+    which are the only properties it can filter and order on. Those
+    properties must hold scalar values."""
+
+    def __init__(self, path=':memory:', indexed=None):
+        self._connection = sqlite3.connect(path, check_same_thread=False,
+                                           isolation_level=None)
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._indexed = indexed or INDEXED_PROPERTIES
+        for kind, properties in self._indexed.items():
+            columns = ''.join(', "{}"'.format(name) for name in properties)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" (id TEXT PRIMARY KEY, '
+                'data TEXT NOT NULL{})'.format(kind, columns))
+            for name in properties:
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" '
+                    '("{1}", id)'.format(kind, name))
+
+    def make_id(self, kind, name):
+        return name
+
+    def get_multi(self, kind, ids):
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), SQLITE_BATCH_SIZE):
+                batch = ids[start:start + SQLITE_BATCH_SIZE]
+                rows = self._connection.execute(
+                    'SELECT id, data FROM "{}" WHERE id IN ({})'.format(
+                        kind, ', '.join('?' * len(batch))), batch)
+                for record_id, data in rows:
+                    found[record_id] = data
+        return [json.loads(found[record_id]) if record_id in found else None
+                for record_id in ids]
+
+    def put_multi(self, kind, records):
+        properties = self._indexed[kind]
+        for record in records:
+            if not record.get('id'):
+                record['id'] = uuid.uuid4().hex
+        statement = 'INSERT OR REPLACE INTO "{}" (id, data{}) ' \
+            'VALUES ({})'.format(
+                kind, ''.join(', "{}"'.format(name) for name in properties),
+                ', '.join('?' * (len(properties) + 2)))
+        with self._lock:
+            self._write(lambda: self._connection.executemany(
+                statement,
+                [[record['id'], json.dumps(record)] +
+                 [record.get(name) for name in properties]
+                 for record in records]))
+        return [record['id'] for record in records]
+
+    def delete_multi(self, kind, ids):
+        with self._lock:
+            self._write(lambda: self._connection.executemany(
+                'DELETE FROM "{}" WHERE id = ?'.format(kind),
+                [[record_id] for record_id in ids]))
+
+    def _write(self, write):
+        if self._in_transaction:
+            write()
+        else:
+            self.transaction(write)
+
+    def _column(self, kind, name):
+        if name not in self._indexed[kind]:
+            raise ValueError('{}.{} is not indexed'.format(kind, name))
+        return '"{}"'.format(name)
+
+    def query(self, kind, filters=(), order=None,
+              page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        prop, descending = _parse_order(order)
+        clauses = ['{} = ?'.format(self._column(kind, name))
+                   for name, _ in filters]
+        params = [value for _, value in filters]
+        if cursor:
+            last = _decode_cursor(cursor)
+            comparison = '<' if descending else '>'
+            if prop:
+                column = self._column(kind, prop)
+                clauses.append('({0} {1} ? OR ({0} = ? AND id {1} ?))'.format(
+                    column, comparison))
+                params.extend([last[0], last[0], last[1]])
+            else:
+                clauses.append('id {} ?'.format(comparison))
+                params.append(last[1])
+        direction = ' DESC' if descending else ''
+        sort = ['id' + direction]
+        if prop:
+            sort.insert(0, self._column(kind, prop) + direction)
+        statement = 'SELECT data FROM "{}"{} ORDER BY {} LIMIT ?'.format(
+            kind, ' WHERE ' + ' AND '.join(clauses) if clauses else '',
+            ', '.join(sort))
+        with self._lock:
+            rows = self._connection.execute(
+                statement, params + [page_size + 1]).fetchall()
+        records = [json.loads(data) for data, in rows]
+        next_cursor = None
+        if len(records) > page_size:
+            records = records[:page_size]
+            next_cursor = _encode_cursor(
+                [records[-1].get(prop) if prop else None, records[-1]['id']])
+        return records, next_cursor
+
+    def transaction(self, function):
+        with self._lock:
+            if self._in_transaction:
+                return function()
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._in_transaction = True
+            try:
+                result = function()
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            else:
+                self._connection.execute('COMMIT')
+            finally:
+                self._in_transaction = False
+            return result
+
+
+class NdbBackend(Backend):
+    """Keeps records as the models.py entities in the datastore, so they
+    are the same data, indexes and caches the endpoints use. Queries use
+    the datastore's indexes and cursors.
+
+    Games are read-only here: in the datastore they are only written by
+    models.Game, which also queues the leaderboard and game result tasks
+    in the same transaction. Creating, playing and cancelling games
+    through a GameRepository on this backend raises WriteNotAllowed."""
+
+    def __init__(self):
+        from google.appengine.ext import ndb
+        import models
+        self._ndb = ndb
+        self._models = {'User': models.User,
+                        'Game': models.Game,
+                        'GameData': models.GameData}
+
+    def make_id(self, kind, name):
+        return self._ndb.Key(self._models[kind], name).urlsafe()
+
+    def _to_value(self, value):
+        if isinstance(value, list):
+            return [self._to_value(item) for item in value]
+        if isinstance(value, self._ndb.Key):
+            return value.urlsafe()
+        if isinstance(value, datetime.datetime):
+            return value.strftime(DATETIME_FORMAT)
+        return value
+
+    def _from_value(self, prop, value):
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return [self._from_value(prop, item) for item in value]
+        if isinstance(prop, self._ndb.KeyProperty):
+            return self._ndb.Key(urlsafe=value)
+        if isinstance(prop, self._ndb.DateTimeProperty):
+            return datetime.datetime.strptime(value, DATETIME_FORMAT)
+        return value
+
+    def _to_record(self, entity):
+        record = dict((name, self._to_value(value))
+                      for name, value in entity.to_dict().items())
+        record['id'] = entity.key.urlsafe()
+        return record
+
+    def _to_entity(self, kind, record):
+        model = self._models[kind]
+        values = dict((name, self._from_value(model._properties[name], value))
+                      for name, value in record.items()
+                      if name in model._properties)
+        if record.get('id'):
+            values['key'] = self._ndb.Key(urlsafe=record['id'])
+        return model(**values)
+
+    def get_multi(self, kind, ids):
+        entities = self._ndb.get_multi([self._ndb.Key(urlsafe=record_id)
+                                        for record_id in ids])
+        return [self._to_record(entity)
+                if entity and entity.key.kind() == kind else None
+                for entity in entities]
+
+    def _check_writable(self, kind):
+        if kind in READ_ONLY_NDB_KINDS:
+            raise WriteNotAllowed(
+                '{} entities are written by models.py, not storage.py'
+                .format(kind))
+
+    def put_multi(self, kind, records):
+        self._check_writable(kind)
+        keys = self._ndb.put_multi([self._to_entity(kind, record)
+                                    for record in records])
+        for record, key in zip(records, keys):
+            record['id'] = key.urlsafe()
+        return [record['id'] for record in records]
+
+    def delete_multi(self, kind, ids):
+        self._check_writable(kind)
+        self._ndb.delete_multi([self._ndb.Key(urlsafe=record_id)
+                                for record_id in ids])
+
+    def query(self, kind, filters=(), order=None,
+              page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        from google.appengine.datastore.datastore_query import Cursor
+        model = self._models[kind]
+        query = model.query(*[
+            model._properties[name] ==
+            self._from_value(model._properties[name], value)
+            for name, value in filters])
+        prop, descending = _parse_order(order)
+        if prop:
+            query = query.order(-model._properties[prop] if descending
+                                else model._properties[prop])
+        entities, next_cursor, more = query.fetch_page(
+            page_size, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        return ([self._to_record(entity) for entity in entities],
+                next_cursor.urlsafe() if more and next_cursor else None)
+
+    def transaction(self, function):
+        return self._ndb.transaction(function, xg=True)
+
+
+class UserRepository(object):
+    KIND = 'User'
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_by_name(self, name):
+        """Returns the user record keyed by name, or None."""
+        return self.backend.get_multi(
+            self.KIND, [self.backend.make_id(self.KIND, name)])[0]
+
+    def get_multi(self, ids):
+        return self.backend.get_multi(self.KIND, ids)
+
+    def create(self, name, email=None):
+        """Creates a user keyed by name. Returns the new record, or None
+        if the name is taken."""
+        user_id = self.backend.make_id(self.KIND, name)
+
+        def _create():
+            if self.backend.get_multi(self.KIND, [user_id])[0]:
+                return None
+            user = {'id': user_id, 'name': name, 'email': email,
+                    'points_earned': 0}
+            self.backend.put_multi(self.KIND, [user])
+            return user
+        return self.backend.transaction(_create)
+
+    def rankings(self, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Returns a page of users by points_earned, highest first."""
+        return self.backend.query(self.KIND, order='-points_earned',
+                                  page_size=page_size, cursor=cursor)
+
+
+class GameDataRepository(object):
+    KIND = 'GameData'
+
+    def __init__(self, backend):
+        self.backend = backend
+        # sayer_category -> list of game data ids
+        self._pools = {}
+
+    def add_multi(self, records):
+        """Writes game data records. Returns their ids."""
+        ids = self.backend.put_multi(self.KIND, records)
+        for record in records:
+            pool = self._pools.get(record['sayer_category'])
+            if pool is not None:
+                pool.append(record['id'])
+        return ids
+
+    def get_pool(self, sayer_category):
+        """Returns the ids of all game data in a category. The pool is read
+        once and then kept up to date by add_multi."""
+        if sayer_category not in self._pools:
+            pool, cursor = [], None
+            while True:
+                records, cursor = self.backend.query(
+                    self.KIND, [('sayer_category', sayer_category)],
+                    cursor=cursor)
+                pool.extend(record['id'] for record in records)
+                if not cursor:
+                    break
+            self._pools[sayer_category] = pool
+        return self._pools[sayer_category]
+
+    def get_random(self, sayer_category):
+        """Returns a game data record picked at random from a category, or
+        None if the category is empty."""
+        pool = self.get_pool(sayer_category)
+        if not pool:
+            return None
+        return self.backend.get_multi(self.KIND, [random.choice(pool)])[0]
+
+
+class GameRepository(object):
+    KIND = 'Game'
+
+    def __init__(self, backend, users=None, game_data=None):
+        self.backend = backend
+        self.users = users or UserRepository(backend)
+        self.game_data = game_data or GameDataRepository(backend)
+
+    def get_multi(self, ids):
+        return self.backend.get_multi(self.KIND, ids)
+
+    def _get_writable_users(self, user_ids):
+        """Returns user id -> user record for the distinct user_ids, read
+        in the calling transaction.
+        Raises:
+            UserUnavailableError: if a user does not exist or is being
+            re-keyed."""
+        user_ids = list(set(user_ids))
+        users = dict(zip(user_ids, self.users.get_multi(user_ids)))
+        for user_id, user in users.items():
+            if not user:
+                raise UserUnavailableError(
+                    'User {} not found.'.format(user_id))
+            if user.get('rekeying'):
+                raise UserUnavailableError(
+                    'This user is being migrated. Please try again shortly.')
+        return users
+
+    def build(self, user_id, sayer_category, num_hints, game_data):
+        """Returns a new, unsaved game record."""
+        hints = game_rules.split_hints(game_data['hints'])
+        return {'user': user_id,
+                'sayer_category': sayer_category,
+                'who_says': game_data['sayer'],
+                'saying': game_data['saying'],
+                'status': 'NEW',
+                'points': game_rules.points_for(num_hints),
+                'num_hints': num_hints,
+                'hints': game_rules.hint_sentences(hints, num_hints),
+                'game_data': game_data['id'],
+                'created': _now()}
+
+    def new_games(self, requests):
+        """Creates a batch of games with a single put, counting them in
+        their users' stats in the same transaction.
+        Args:
+            requests: A list of (user id, sayer_category, num_hints)
+        Returns:
+            The new game records, in order.
+        Raises:
+            ValueError: if num_hints is out of range or a sayer_category
+            has no game data.
+            UserUnavailableError: if a user does not exist or is being
+            re-keyed. No game is written.
+            WriteNotAllowed: on NdbBackend."""
+        games = []
+        for user_id, sayer_category, num_hints in requests:
+            game_rules.points_for(num_hints)
+            game_data = self.game_data.get_random(sayer_category)
+            if not game_data:
+                raise ValueError('sayer_category not found.')
+            games.append(self.build(user_id, sayer_category, num_hints,
+                                    game_data))
+
+        def _start():
+            users = self._get_writable_users(game['user'] for game in games)
+            for game in games:
+                game_rules.count_new_game(users[game['user']],
+                                          game['num_hints'])
+            self.backend.put_multi(self.KIND, games)
+            self.backend.put_multi(self.users.KIND, users.values())
+        self.backend.transaction(_start)
+        return games
+
+    def make_moves(self, moves):
+        """Applies a batch of guesses in one transaction, crediting the
+        users of won games and counting every game in its user's stats.
+        Args:
+            moves: A list of (game id, guess)
+        Returns:
+            The game records after the moves, in order, with None for games
+            that do not exist. Games that were already over are
+            unchanged.
+        Raises:
+            UserUnavailableError: if the user of a NEW game does not exist
+            or is being re-keyed. No game is settled."""
+        def _move():
+            games = self.get_multi([game_id for game_id, _ in moves])
+            users = self._get_writable_users(
+                game['user'] for game in games
+                if game and game['status'] == 'NEW')
+            ended = _now()
+            settled = []
+            for game, (_, guess) in zip(games, moves):
+                if not game or game['status'] != 'NEW':
+                    continue
+                game['ended'] = ended
+                game['status'] = game_rules.outcome(game['who_says'], guess)
+                user = users[game['user']]
+                if game['status'] == 'WON':
+                    user['points_earned'] += game['points']
+                game_rules.count_finished_game(user, game['status'],
+                                               game['sayer_category'],
+                                               game['points'])
+                settled.append(game)
+            self.backend.put_multi(self.KIND, settled)
+            self.backend.put_multi(self.users.KIND, [
+                users[user_id]
+                for user_id in set(game['user'] for game in settled)])
+            return games
+        return self.backend.transaction(_move)
+
+    def cancel(self, game_id):
+        """Cancels a NEW game. Returns the game record, or None if there is
+        no such game.
+        Raises:
+            UserUnavailableError: if the game is NEW and its user does not
+            exist or is being re-keyed."""
+        def _cancel():
+            game = self.get_multi([game_id])[0]
+            if game and game['status'] == 'NEW':
+                user = self._get_writable_users([game['user']])[game['user']]
+                game['status'] = 'CANCELLED'
+                game['ended'] = _now()
+                game_rules.count_finished_game(user, game['status'],
+                                               game['sayer_category'],
+                                               game['points'])
+                self.backend.put_multi(self.KIND, [game])
+                self.backend.put_multi(self.users.KIND, [user])
+            return game
+        return self.backend.transaction(_cancel)
+
+    def games_for_user(self, user_id, page_size=DEFAULT_PAGE_SIZE,
+                       cursor=None):
+        """Returns a page of a user's games."""
+        return self.backend.query(self.KIND, [('user', user_id)],
+                                  page_size=page_size, cursor=cursor)
+
+    def scores(self, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Returns a page of won games."""
+        return self.backend.query(self.KIND, [('status', 'WON')],
+                                  page_size=page_size, cursor=cursor)
+
+    def high_scores(self, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+        """Returns a page of won games, highest points first."""
+        return self.backend.query(self.KIND, [('status', 'WON')],
+                                  order='-points', page_size=page_size,
+                                  cursor=cursor)
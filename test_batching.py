@@ -0,0 +1,46 @@
+"""test_batching.py - Tests for batching.py. Run with:
+python -m unittest test_batching"""
+
+import unittest
+
+from batching import chunk_by_groups
+
+MAX_GROUPS = 25
+
+
+def groups_in(chunk, shared_groups=0):
+    return len(chunk) + len(set(owner for owner, _ in chunk)) + shared_groups
+
+
+class ChunkByGroupsTest(unittest.TestCase):
+
+    def check(self, items, shared_groups=0):
+        chunks = chunk_by_groups(items, lambda item: item[0], MAX_GROUPS,
+                                 shared_groups)
+        self.assertEqual([item for chunk in chunks for item in chunk], items)
+        for chunk in chunks:
+            self.assertLessEqual(groups_in(chunk, shared_groups), MAX_GROUPS)
+        return chunks
+
+    def test_empty(self):
+        self.assertEqual(self.check([]), [])
+
+    def test_one_game_per_owner(self):
+        items = [(owner, 0) for owner in range(100)]
+        chunks = self.check(items)
+        self.assertEqual(len(chunks[0]), 12)
+
+    def test_one_game_per_owner_with_a_shared_group(self):
+        chunks = self.check([(owner, 0) for owner in range(100)], 1)
+        self.assertEqual(len(chunks[0]), 12)
+
+    def test_one_owner(self):
+        chunks = self.check([(0, game) for game in range(100)])
+        self.assertEqual(len(chunks[0]), 24)
+
+    def test_mixed_owners(self):
+        self.check([(game % 7, game) for game in range(200)], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""test_score_tree.py - Tests for score_tree.py. Run with:
+python -m unittest test_score_tree"""
+
+import collections
+import random
+import unittest
+
+import score_tree
+
+
+class ScoreTreeTest(unittest.TestCase):
+
+    def count_above(self, counts, points):
+        nodes, top_index = score_tree.nodes_above(points)
+        ahead = sum(counts[node] for node in nodes)
+        ahead += sum(count for (level, index), count in counts.items()
+                     if level == score_tree.TOP_LEVEL and index > top_index)
+        return ahead
+
+    def check(self, scores):
+        counts = collections.Counter()
+        for points in scores:
+            counts.update(score_tree.nodes_for(points))
+        for points in set(scores) | {0, 1, max(scores) + 1}:
+            self.assertEqual(self.count_above(counts, points),
+                             sum(1 for other in scores if other > points),
+                             points)
+
+    def test_nodes_for_has_one_node_per_level(self):
+        self.assertEqual(score_tree.nodes_for(300),
+                         [(0, 300), (1, 18), (2, 1), (3, 0), (4, 0)])
+
+    def test_at_most_branching_minus_one_siblings_per_level(self):
+        nodes, _ = score_tree.nodes_above(0)
+        for level in range(score_tree.TOP_LEVEL):
+            self.assertEqual(
+                sum(1 for node_level, _ in nodes if node_level == level),
+                score_tree.BRANCHING - 1)
+
+    def test_counts_match_brute_force(self):
+        rng = random.Random(4)
+        self.check([rng.choice([85, 80, 72, 59, 38, 4]) * rng.randint(1, 40)
+                    for _ in range(500)])
+
+    def test_counts_match_brute_force_past_the_top_level(self):
+        width = score_tree.BRANCHING ** score_tree.TOP_LEVEL
+        self.check([width - 1, width, width + 1, 3 * width + 5, 85, 85])
+
+
+if __name__ == '__main__':
+    unittest.main()
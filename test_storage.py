@@ -0,0 +1,226 @@
+"""test_storage.py - Tests for the storage.py backends that run without the
+App Engine SDK. Run with: python -m unittest test_storage"""
+
+import unittest
+
+import storage
+
+
+class BackendTests(object):
+    """Tests every backend that runs outside App Engine must pass.
+    Subclasses set make_backend."""
+
+    def setUp(self):
+        self.backend = self.make_backend()
+
+    def put_users(self, points):
+        users = [{'id': 'user{:02d}'.format(i), 'name': 'user{:02d}'.format(i),
+                  'points_earned': p} for i, p in enumerate(points)]
+        self.backend.put_multi('User', users)
+        return users
+
+    def read_all(self, **kwargs):
+        pages, cursor = [], None
+        while True:
+            records, cursor = self.backend.query('User', cursor=cursor,
+                                                 **kwargs)
+            pages.append(records)
+            if not cursor:
+                return pages
+
+    def test_get_multi_returns_none_for_missing_ids(self):
+        self.put_users([1])
+        records = self.backend.get_multi('User', ['missing', 'user00'])
+        self.assertIsNone(records[0])
+        self.assertEqual(records[1]['name'], 'user00')
+
+    def test_put_multi_gives_ids(self):
+        records = [{'name': 'a', 'points_earned': 0},
+                   {'name': 'b', 'points_earned': 0}]
+        ids = self.backend.put_multi('User', records)
+        self.assertEqual(ids, [record['id'] for record in records])
+        self.assertEqual(len(set(ids)), 2)
+
+    def test_query_pages_cover_every_record_once(self):
+        self.put_users(range(25))
+        pages = self.read_all(page_size=10)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        ids = [record['id'] for page in pages for record in page]
+        self.assertEqual(sorted(ids), ['user{:02d}'.format(i)
+                                       for i in range(25)])
+
+    def test_query_orders_descending_across_pages_with_ties(self):
+        self.put_users([5, 3, 5, 1, 3, 5, 0])
+        pages = self.read_all(order='-points_earned', page_size=2)
+        records = [record for page in pages for record in page]
+        self.assertEqual([record['points_earned'] for record in records],
+                         [5, 5, 5, 3, 3, 1, 0])
+        # Ties are broken by id, in the same direction.
+        self.assertEqual([record['id'] for record in records[:3]],
+                         ['user05', 'user02', 'user00'])
+        self.assertEqual(len(set(record['id'] for record in records)), 7)
+
+    def test_query_filters_before_paging(self):
+        self.put_users([1, 2, 1, 2, 1])
+        pages = self.read_all(filters=[('points_earned', 1)], page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 1])
+        self.assertTrue(all(record['points_earned'] == 1
+                            for page in pages for record in page))
+
+    def test_query_exact_page_has_no_next_cursor(self):
+        self.put_users(range(4))
+        records, cursor = self.backend.query('User', page_size=4)
+        self.assertEqual(len(records), 4)
+        self.assertIsNone(cursor)
+
+    def test_query_rejects_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            self.backend.query('User', cursor='not a cursor')
+
+    def test_transaction_commits(self):
+        def _write():
+            self.put_users([7])
+            return 'done'
+        self.assertEqual(self.backend.transaction(_write), 'done')
+        self.assertEqual(
+            self.backend.get_multi('User', ['user00'])[0]['points_earned'],
+            7)
+
+    def test_transaction_rolls_back_on_error(self):
+        users = self.put_users([1, 2])
+
+        def _write():
+            users[0]['points_earned'] = 100
+            self.backend.put_multi('User', [users[0]])
+            self.backend.delete_multi('User', ['user01'])
+            self.backend.put_multi('User', [{'id': 'new', 'name': 'new',
+                                             'points_earned': 0}])
+            raise RuntimeError('abort')
+        with self.assertRaises(RuntimeError):
+            self.backend.transaction(_write)
+        records = self.backend.get_multi('User', ['user00', 'user01', 'new'])
+        self.assertEqual(records[0]['points_earned'], 1)
+        self.assertEqual(records[1]['points_earned'], 2)
+        self.assertIsNone(records[2])
+
+    def test_nested_transaction_joins_the_outer_one(self):
+        def _inner():
+            self.put_users([3])
+
+        def _outer():
+            self.backend.transaction(_inner)
+            raise RuntimeError('abort')
+        with self.assertRaises(RuntimeError):
+            self.backend.transaction(_outer)
+        self.assertIsNone(self.backend.get_multi('User', ['user00'])[0])
+
+
+class RepositoryTests(object):
+    """Tests of the repositories on a backend. Subclasses set
+    make_backend."""
+
+    def setUp(self):
+        self.backend = self.make_backend()
+        self.games = storage.GameRepository(self.backend)
+        self.games.game_data.add_multi([{
+            'sayer_category': 'ACTOR', 'sayer': 'Ann', 'saying': 'Hello',
+            'hints': ['1999', 'film', 'female', 'radio', 'AA']}])
+        self.user = self.games.users.create('ann')
+
+    def get_user(self):
+        return self.games.users.get_by_name('ann')
+
+    def test_create_refuses_taken_name(self):
+        self.assertIsNone(self.games.users.create('ann'))
+
+    def test_new_games_counts_stats(self):
+        games = self.games.new_games([(self.user['id'], 'ACTOR', 2),
+                                      (self.user['id'], 'ACTOR', 1)])
+        self.assertEqual([game['status'] for game in games], ['NEW', 'NEW'])
+        self.assertEqual(games[0]['points'], 72)
+        user = self.get_user()
+        self.assertEqual(user['games_played'], 2)
+        self.assertEqual(user['hints_bought'], 3)
+
+    def test_new_games_writes_nothing_on_bad_request(self):
+        with self.assertRaises(ValueError):
+            self.games.new_games([(self.user['id'], 'ACTOR', 0),
+                                  (self.user['id'], 'SINGER', 0)])
+        records, _ = self.games.games_for_user(self.user['id'])
+        self.assertEqual(records, [])
+
+    def test_make_moves_settles_each_game_once(self):
+        won, lost = self.games.new_games([(self.user['id'], 'ACTOR', 0),
+                                          (self.user['id'], 'ACTOR', 0)])
+        games = self.games.make_moves([(won['id'], 'Ann'),
+                                       (lost['id'], 'Bob'),
+                                       ('missing', 'Ann')])
+        self.assertEqual(games[0]['status'], 'WON')
+        self.assertEqual(games[1]['status'], 'LOST')
+        self.assertIsNone(games[2])
+        # A second guess at a finished game changes nothing.
+        self.games.make_moves([(won['id'], 'Ann')])
+        user = self.get_user()
+        self.assertEqual(user['points_earned'], 85)
+        self.assertEqual(user['games_won'], 1)
+        self.assertEqual(user['games_lost'], 1)
+        self.assertEqual(user['points_by_category'], {'ACTOR': 85})
+
+    def test_cancel(self):
+        game, = self.games.new_games([(self.user['id'], 'ACTOR', 0)])
+        self.assertEqual(self.games.cancel(game['id'])['status'],
+                         'CANCELLED')
+        self.assertIsNone(self.games.cancel('missing'))
+        self.assertEqual(self.get_user()['games_cancelled'], 1)
+
+    def test_unknown_user_raises_and_writes_nothing(self):
+        with self.assertRaises(storage.UserUnavailableError):
+            self.games.new_games([(self.user['id'], 'ACTOR', 0),
+                                  ('nobody', 'ACTOR', 0)])
+        records, _ = self.games.games_for_user(self.user['id'])
+        self.assertEqual(records, [])
+        self.assertEqual(self.get_user().get('games_played', 0), 0)
+
+    def test_rekeying_user_blocks_moves_and_cancel(self):
+        game, = self.games.new_games([(self.user['id'], 'ACTOR', 0)])
+        user = self.get_user()
+        user['rekeying'] = True
+        self.backend.put_multi('User', [user])
+        with self.assertRaises(storage.UserUnavailableError):
+            self.games.make_moves([(game['id'], 'Ann')])
+        with self.assertRaises(storage.UserUnavailableError):
+            self.games.cancel(game['id'])
+        self.assertEqual(self.games.get_multi([game['id']])[0]['status'],
+                         'NEW')
+        self.assertEqual(self.get_user()['points_earned'], 0)
+
+    def test_high_scores_page_by_points(self):
+        games = self.games.new_games([(self.user['id'], 'ACTOR', n)
+                                      for n in range(4)])
+        self.games.make_moves([(game['id'], 'Ann') for game in games])
+        first, cursor = self.games.high_scores(page_size=3)
+        rest, last_cursor = self.games.high_scores(page_size=3,
+                                                   cursor=cursor)
+        self.assertEqual([game['points'] for game in first + rest],
+                         [85, 80, 72, 59])
+        self.assertIsNone(last_cursor)
+
+
+class MemoryBackendTest(BackendTests, unittest.TestCase):
+    make_backend = storage.MemoryBackend
+
+
+class SqliteBackendTest(BackendTests, unittest.TestCase):
+    make_backend = storage.SqliteBackend
+
+
+class MemoryRepositoryTest(RepositoryTests, unittest.TestCase):
+    make_backend = storage.MemoryBackend
+
+
+class SqliteRepositoryTest(RepositoryTests, unittest.TestCase):
+    make_backend = storage.SqliteBackend
+
+
+if __name__ == '__main__':
+    unittest.main()
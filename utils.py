@@ -1,8 +1,17 @@
 """utils.py - File for collecting general utility functions."""
 
+import collections
 import logging
+import threading
+import time
+
+from google.appengine.api import datastore_errors, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-import endpoints
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
@@ -17,8 +26,40 @@ def get_by_urlsafe(urlsafe, model):
         exists.
     Raises:
         ValueError:"""
+    entity = _key_from_urlsafe(urlsafe).get()
+    if not entity:
+        return None
+    if not isinstance(entity, model):
+        raise ValueError('Incorrect Kind')
+    return entity
+
+
+def get_multi_by_urlsafe(urlsafes, model):
+    """Batch version of get_by_urlsafe, fetching every entity with a single
+        get_multi.
+    Args:
+        urlsafes: A list of urlsafe key strings
+        model: The expected entity kind
+    Returns:
+        A list of the entities, in order, with None for keys that have no
+        entity.
+    Raises:
+        ValueError:"""
+    entities = ndb.get_multi([_key_from_urlsafe(urlsafe)
+                              for urlsafe in urlsafes])
+    for entity in entities:
+        if entity and not isinstance(entity, model):
+            raise ValueError('Incorrect Kind')
+    return entities
+
+
+def _key_from_urlsafe(urlsafe):
+    # endpoints is imported where it is raised rather than at the top of the
+    # module, since models.py imports utils and main.py imports models
+    # without wanting the endpoints API loaded.
+    import endpoints
     try:
-        key = ndb.Key(urlsafe=urlsafe)
+        return ndb.Key(urlsafe=urlsafe)
     except TypeError:
         raise endpoints.BadRequestException('Invalid Key')
     except Exception, e:
@@ -27,9 +68,100 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
-    return entity
+
+def get_user_names(games):
+    """Resolves the User names for a batch of Games with a single get_multi.
+    Args:
+        games: An iterable of Game entities
+    Returns:
+        A dict mapping each distinct User key to that User's name."""
+    user_keys = list(set(game.user for game in games))
+    users = ndb.get_multi(user_keys)
+    return dict((key, user.name) for key, user in zip(user_keys, users)
+                if user)
+
+
+def check_page_size(page_size):
+    """Returns the requested page size, or DEFAULT_PAGE_SIZE if none was
+    given.
+    Raises:
+        endpoints.BadRequestException: if the page size is out of range."""
+    import endpoints
+    if page_size is None:
+        return DEFAULT_PAGE_SIZE
+    if page_size < 1 or page_size > MAX_PAGE_SIZE:
+        raise endpoints.BadRequestException(
+            'page_size must be between 1 and {}'.format(MAX_PAGE_SIZE))
+    return page_size
+
+
+def fetch_page(query, page_size=None, cursor=None):
+    """Fetches one page of query results.
+    Args:
+        query: The ndb.Query to run
+        page_size: Maximum number of results, defaults to DEFAULT_PAGE_SIZE
+        cursor: A urlsafe cursor string returned by a previous page
+    Returns:
+        A (results, next_cursor) tuple. next_cursor is a urlsafe cursor
+        string, or None when there are no more results.
+    Raises:
+        endpoints.BadRequestException: if the page size or cursor is
+        invalid."""
+    import endpoints
+    page_size = check_page_size(page_size)
+    try:
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except datastore_errors.BadValueError:
+        raise endpoints.BadRequestException('Invalid cursor')
+    results, next_cursor, more = query.fetch_page(page_size,
+                                                  start_cursor=start_cursor)
+    if more and next_cursor:
+        return results, next_cursor.urlsafe()
+    return results, None
+
+
+class LRUCache(object):
+    """A thread-safe, size-bounded in-process cache. Entries are evicted in
+    least recently used order and expire ttl seconds after being set."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if absent or expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@ndb.tasklet
+def add_tasks_async(tasks, transactional=False):
+    """Adds tasks to the default queue from a tasklet. Wrapping the queue
+    RPC in a tasklet lets it be yielded alongside ndb futures."""
+    result = yield taskqueue.Queue().add_async(tasks,
+                                               transactional=transactional)
+    raise ndb.Return(result)
@@ -8,39 +8,79 @@ import endpoints
 from protorpc import messages
 from protorpc import remote
 
-from google.appengine.api import memcache
 
-from utils import get_by_urlsafe
+import game_rules
+import instrumentation
+import leaderboard
+import refresh
+import response_cache
+from utils import (
+    get_by_urlsafe,
+    get_multi_by_urlsafe,
+    get_user_names,
+    check_page_size,
+    fetch_page)
 
 from models import (
     User,
     StringMessage,
     NewGameDataForm,
+    NewGameDataForms,
     GameData,
     NewGameForm,
+    NewGameForms,
     GameForm,
     GameForms,
     Game,
+    GamePointsShard,
+    HighScoreTable,
+    HIGH_SCORE_TABLE_SIZE,
     MakeMoveForm,
+    MoveForms,
     ScoreForms,
+    RankingForm,
     Rankings,
+    UserStatsForm,
     GameHighScores,
-    Analysis)
+    Analysis,
+    GameRollup,
+    GameRollupForms,
+    GameHistory,
+    BatchInterruptedError,
+    UserUnavailableError)
 
 
 USER_REQUEST = endpoints.ResourceContainer(
     user_name=messages.StringField(1),
     email=messages.StringField(2))
+USER_PAGE_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3))
+PAGE_REQUEST = endpoints.ResourceContainer(
+    page_size=messages.IntegerField(1),
+    cursor=messages.StringField(2))
 ADD_DATA = endpoints.ResourceContainer(NewGameDataForm)
+MAX_ADD_DATA_BATCH = 1000
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
+MAX_PLAY_BATCH = 500
+ARCHIVE_CURSOR_PREFIX = 'archived:'
+AVERAGE_GAME_POINTS_REFRESH = 'average_game_points'
+AVERAGE_GAME_POINTS_REFRESH_INTERVAL = 60
 GET_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1))
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1))
-MEMCACHE_AVE_PTS_PER_GAME = 'AVE_PTS_PER_GAME'
 HIGH_SCORE_REQUEST = endpoints.ResourceContainer(
-    number_of_results=messages.IntegerField(1))
+    number_of_results=messages.IntegerField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3))
+ROLLUPS_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1))
+RANKINGS_REQUEST = endpoints.ResourceContainer(
+    offset=messages.IntegerField(1),
+    limit=messages.IntegerField(2))
 
 package = 'WhoSays'
 
@@ -56,11 +96,11 @@ class WhoSaysApi(remote.Service):
                       http_method='POST')
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        if not request.user_name:
+            raise endpoints.BadRequestException('user_name is required.')
+        if not User.create(request.user_name, request.email):
             raise endpoints.ConflictException(
                 'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
         return StringMessage(message='User {} created!'.format(
             request.user_name))
 
@@ -71,13 +111,34 @@ class WhoSaysApi(remote.Service):
                       http_method='POST')
     def add_data(self, request):
         """Add game data. Administrative."""
-        gData = GameData.new_game_data(sayer_category=request.sayer_category,
-                                       sayer=request.sayer,
-                                       saying=request.saying,
-                                       hints=request.hints)
-        gData.put()
+        try:
+            gData = GameData.new_game_data(
+                sayer_category=request.sayer_category,
+                sayer=request.sayer,
+                saying=request.saying,
+                hints=request.hints)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        return StringMessage(
+            message='Successfully added {}.'.format(gData.saying))
+
+    @endpoints.method(request_message=NewGameDataForms,
+                      response_message=StringMessage,
+                      path='adddata/batch',
+                      name='add_data_batch',
+                      http_method='POST')
+    def add_data_batch(self, request):
+        """Add a batch of game data. Administrative."""
+        if len(request.game_data) > MAX_ADD_DATA_BATCH:
+            raise endpoints.BadRequestException(
+                'At most {} game data items per batch.'.format(
+                    MAX_ADD_DATA_BATCH))
+        try:
+            keys = GameData.new_game_data_multi(request.game_data)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
         return StringMessage(
-            message='Successfully added {}.'.format(request.saying))
+            message='Successfully added {} sayings.'.format(len(keys)))
 
     @endpoints.method(request_message=NEW_GAME_REQUEST,
                       response_message=GameForm,
@@ -86,18 +147,32 @@ class WhoSaysApi(remote.Service):
                       http_method='POST')
     def new_game(self, request):
         """Start a new game."""
-        user = User.query(User.name == request.user_name).get()
+        # Unless the saying depends on the user's history, pick it while
+        # the user is being looked up.
+        user_future = User.get_by_name_async(request.user_name)
+        game_data_future = None
+        if not request.exclude_seen:
+            game_data_future = Game.pick_game_data_async(
+                None, request.sayer_category)
+        user = user_future.get_result()
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
         try:
-            game = Game.new_game(user.key,
-                                 request.sayer_category,
-                                 request.num_hints)
-        except ValueError:
-            raise endpoints.BadRequestException(
-                'Number of hints must be between 0 and 5')
-        return game.to_form("Good luck playing Who Says!")
+            game = Game.new_game_async(
+                user.key,
+                request.sayer_category,
+                request.num_hints,
+                request.exclude_seen,
+                game_data_future and game_data_future.get_result()
+            ).get_result()
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        except UserUnavailableError as e:
+            raise endpoints.ConflictException(str(e))
+        response_cache.bump(response_cache.user_scope(user.key))
+        return game.to_form("Good luck playing Who Says!",
+                            {user.key: user.name})
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
@@ -106,11 +181,16 @@ class WhoSaysApi(remote.Service):
                       http_method='GET')
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game:
-            return game.to_form('Time to take a guess!')
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        def build():
+            game = get_by_urlsafe(request.urlsafe_game_key, Game)
+            if game:
+                return game.to_form('Time to take a guess!')
+            else:
+                raise endpoints.NotFoundException('Game not found!')
+        return response_cache.read_through(
+            'get_game', request,
+            [response_cache.game_scope(request.urlsafe_game_key)],
+            GameForm, build)
 
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
@@ -120,44 +200,206 @@ class WhoSaysApi(remote.Service):
     def make_move(self, request):
         """Make a move and return a game state with message."""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
         if game.status != 'NEW':
             raise endpoints.ForbiddenException(
                 'Illegal action: Game is already over.')
 
-        if request.guess == game.who_says:
-            game.do_move()
-            return game.to_form('You win!')
-
+        scopes = [response_cache.game_scope(request.urlsafe_game_key),
+                  response_cache.user_scope(game.user)]
+        try:
+            if game_rules.outcome(game.who_says, request.guess) == 'WON':
+                user = game.do_move_async().get_result()
+            else:
+                user = game.end_game_async('LOST').get_result()
+        except UserUnavailableError as e:
+            raise endpoints.ConflictException(str(e))
+        if not user:
+            raise endpoints.ForbiddenException(
+                'Illegal action: Game is already over.')
+        if game.status == 'WON':
+            response_cache.bump(response_cache.SCORES_SCOPE, *scopes)
+            refresh.schedule(AVERAGE_GAME_POINTS_REFRESH)
+            return game.to_form('You win!', {user.key: user.name})
         else:
-            game.status = 'LOST'
-            game.put()
-            return game.to_form('You lost.')
+            response_cache.bump(*scopes)
+            return game.to_form('You lost.', {user.key: user.name})
+
+    @endpoints.method(request_message=NewGameForms,
+                      response_message=GameForms,
+                      path='games/new',
+                      name='new_games',
+                      http_method='POST')
+    def new_games(self, request):
+        """Start a batch of new games. A batch is written in several
+        transactions; if a user is migrated partway through, the conflict
+        error lists the games that were already started."""
+        if len(request.games) > MAX_PLAY_BATCH:
+            raise endpoints.BadRequestException(
+                'At most {} games per batch.'.format(MAX_PLAY_BATCH))
+        # Concurrent lookups are batched by ndb into one datastore get.
+        names = list(set(form.user_name for form in request.games))
+        user_futures = [User.get_by_name_async(name) for name in names]
+        users = dict((name, future.get_result())
+                     for name, future in zip(names, user_futures))
+        missing = sorted(name for name, user in users.items() if not user)
+        if missing:
+            raise endpoints.NotFoundException(
+                'Users not found: {}'.format(', '.join(missing)))
+        # Checked up front so that no chunk of the batch is written.
+        if any(user.rekeying for user in users.values()):
+            raise endpoints.ConflictException(
+                'A user is being migrated. Please try again shortly.')
+        try:
+            game_futures = [Game.build_game_async(users[form.user_name].key,
+                                                  form.sayer_category,
+                                                  form.num_hints,
+                                                  form.exclude_seen)
+                            for form in request.games]
+            games = [future.get_result() for future in game_futures]
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        try:
+            Game.start_games(games)
+        except BatchInterruptedError as e:
+            response_cache.bump(*[response_cache.user_scope(game.user)
+                                  for game in e.started])
+            raise endpoints.ConflictException(
+                '{} Only these games were started: {}'.format(
+                    e, ', '.join(game.key.urlsafe() for game in e.started)))
+        except UserUnavailableError as e:
+            raise endpoints.ConflictException(str(e))
+        response_cache.bump(*[response_cache.user_scope(user.key)
+                              for user in users.values()])
+        user_names = dict((user.key, user.name) for user in users.values())
+        return GameForms(games=[game.to_form("Good luck playing Who Says!",
+                                             user_names)
+                                for game in games])
+
+    @endpoints.method(request_message=MoveForms,
+                      response_message=GameForms,
+                      path='games/moves',
+                      name='make_moves',
+                      http_method='POST')
+    def make_moves(self, request):
+        """Make a move in each of a batch of games and return their game
+        states with messages. Games that are already over are returned
+        unchanged."""
+        if len(request.moves) > MAX_PLAY_BATCH:
+            raise endpoints.BadRequestException(
+                'At most {} moves per batch.'.format(MAX_PLAY_BATCH))
+        urlsafes = [move.urlsafe_game_key for move in request.moves]
+        if len(set(urlsafes)) != len(urlsafes):
+            raise endpoints.BadRequestException(
+                'Each game may only be moved once per batch.')
+        games = get_multi_by_urlsafe(urlsafes, Game)
+        if not all(games):
+            raise endpoints.NotFoundException('Games not found: {}'.format(
+                ', '.join(urlsafe for urlsafe, game in zip(urlsafes, games)
+                          if not game)))
+
+        moves = [(game, move.guess)
+                 for game, move in zip(games, request.moves)
+                 if game.status == 'NEW']
+        settled = Game.settle_moves(moves)
 
-    @endpoints.method(response_message=ScoreForms,
+        forms = []
+        scopes = set()
+        won = False
+        user_names = get_user_names(games)
+        for game in games:
+            if game.key not in settled:
+                if game.status == 'NEW':
+                    # Ended meanwhile, or its user is being migrated.
+                    message = 'Move not applied. Please try again.'
+                else:
+                    message = 'Illegal action: Game is already over.'
+                forms.append(game.to_form(message, user_names))
+                continue
+            game = settled[game.key]
+            if game.status == 'WON':
+                won = True
+                forms.append(game.to_form('You win!', user_names))
+            else:
+                forms.append(game.to_form('You lost.', user_names))
+            scopes.add(response_cache.game_scope(game.key.urlsafe()))
+            scopes.add(response_cache.user_scope(game.user))
+        if won:
+            scopes.add(response_cache.SCORES_SCOPE)
+        if scopes:
+            response_cache.bump(*scopes)
+        if won:
+            refresh.schedule(AVERAGE_GAME_POINTS_REFRESH)
+        return GameForms(games=forms)
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
     def get_scores(self, request):
-        """Return all Game scores."""
-        qResults = Game.query(Game.status == 'WON')
+        """Return a page of Game scores."""
+        qResults, next_cursor = fetch_page(Game.query(Game.status == 'WON'),
+                                           request.page_size,
+                                           request.cursor)
         if not qResults:
             raise endpoints.NotFoundException('Scores not found.')
-        return ScoreForms(scores=[game.to_score_report() for game in qResults])
+        user_names = get_user_names(qResults)
+        return ScoreForms(scores=[game.to_score_report(user_names)
+                          for game in qResults],
+                          next_cursor=next_cursor)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
     def get_user_scores(self, request):
-        """Return all of an individual User's game scores."""
-        user = User.query(User.name == request.user_name).get()
+        """Return a page of an individual User's game scores."""
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
 
-        qResults = Game.query(Game.user == user.key)
-        return ScoreForms(scores=[game.to_score_report() for game in qResults])
+        # Unarchived games come first, then the archived history, whose
+        # pages are addressed by their offset into it. Only the archived
+        # pages are cached: they come from an ancestor query, while the
+        # Game query is eventually consistent and a cached page could
+        # outlive the user scope bump for a game it missed.
+        if request.cursor and request.cursor.startswith(
+                ARCHIVE_CURSOR_PREFIX):
+            try:
+                offset = int(request.cursor[len(ARCHIVE_CURSOR_PREFIX):])
+            except ValueError:
+                offset = -1
+            if offset < 0:
+                raise endpoints.BadRequestException('Invalid cursor')
+
+            def build():
+                scores, next_offset = GameHistory.get_score_page(
+                    user.key, user.name, offset,
+                    check_page_size(request.page_size))
+                next_cursor = None
+                if next_offset is not None:
+                    next_cursor = ARCHIVE_CURSOR_PREFIX + str(next_offset)
+                return ScoreForms(scores=scores, next_cursor=next_cursor)
+            return response_cache.read_through(
+                'get_user_scores', request,
+                [response_cache.user_scope(user.key)],
+                ScoreForms, build)
+
+        qResults, next_cursor = fetch_page(
+            Game.query(Game.user == user.key),
+            request.page_size,
+            request.cursor)
+        if not next_cursor and GameHistory.query(
+                ancestor=user.key).get(keys_only=True):
+            next_cursor = ARCHIVE_CURSOR_PREFIX + '0'
+        user_names = {user.key: user.name}
+        return ScoreForms(scores=[game.to_score_report(user_names)
+                          for game in qResults],
+                          next_cursor=next_cursor)
 
     @endpoints.method(response_message=StringMessage,
                       path='games/averagepoints',
@@ -165,30 +407,32 @@ class WhoSaysApi(remote.Service):
                       http_method='GET')
     def get_average_game_points(self, request):
         """Return average game points."""
-        avePoints = memcache.get(MEMCACHE_AVE_PTS_PER_GAME)
-        if not avePoints:
-            avePoints = 'Average points are not available.'
-        return StringMessage(message=avePoints)
+        return self._cache_average_game_points()
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='games/user/{user_name}',
                       name='get_user_games',
                       http_method='GET')
     def get_user_games(self, request):
-        """Return all of an individual User's games."""
-        user = User.query(User.name == request.user_name).get()
+        """Return a page of an individual User's games in progress."""
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
 
-        qResults = Game.query(Game.user == user.key, Game.status == 'NEW')
+        qResults, next_cursor = fetch_page(
+            Game.query(Game.user == user.key, Game.status == 'NEW'),
+            request.page_size,
+            request.cursor)
         if not qResults:
             raise endpoints.NotFoundException(
                 'There are no user games in progress.')
 
-        return GameForms(games=[game.to_form('Game in progress.')
-                         for game in qResults])
+        user_names = {user.key: user.name}
+        return GameForms(games=[game.to_form('Game in progress.', user_names)
+                         for game in qResults],
+                         next_cursor=next_cursor)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
@@ -201,8 +445,15 @@ class WhoSaysApi(remote.Service):
         if game:
             if game.status != 'NEW':
                 return StringMessage(message='Game already over or cancelled.')
-            game.status = 'CANCELLED'
-            game.put()
+            try:
+                user = game.end_game('CANCELLED')
+            except UserUnavailableError as e:
+                raise endpoints.ConflictException(str(e))
+            if not user:
+                return StringMessage(message='Game already over or cancelled.')
+            response_cache.bump(
+                response_cache.game_scope(request.urlsafe_game_key),
+                response_cache.user_scope(game.user))
             return StringMessage(message='Game cancelled!')
         else:
             raise endpoints.NotFoundException('Game not found!')
@@ -214,49 +465,137 @@ class WhoSaysApi(remote.Service):
                       http_method='GET')
     def get_high_scores(self, request):
         """Return game high scores in descending order."""
-        if request.number_of_results:
-            highScores = Game.query(Game.status == 'WON').order(
-                -Game.points).fetch(request.number_of_results)
-        else:
-            highScores = Game.query(Game.status == 'WON').order(-Game.points)
+        number_of_results = request.number_of_results
+        if number_of_results is not None:
+            if not 1 <= number_of_results <= HIGH_SCORE_TABLE_SIZE:
+                raise endpoints.BadRequestException(
+                    'number_of_results must be between 1 and {}; page '
+                    'through longer lists without it.'.format(
+                        HIGH_SCORE_TABLE_SIZE))
+
+            # The table is a single entity read by key, so it is safe to
+            # cache; the Game query below is eventually consistent.
+            def build():
+                entries = HighScoreTable.get_table().entries
+                if not entries:
+                    raise endpoints.NotFoundException('Scores not found.')
+                return GameHighScores(high_scores=[
+                    entry.to_score_report()
+                    for entry in entries[:number_of_results]])
+            return response_cache.read_through(
+                'get_high_scores', request, [response_cache.SCORES_SCOPE],
+                GameHighScores, build)
+
+        highScores, next_cursor = fetch_page(
+            Game.query(Game.status == 'WON').order(-Game.points),
+            request.page_size,
+            request.cursor)
         if not highScores:
             raise endpoints.NotFoundException('Scores not found.')
-        return GameHighScores(high_scores=[game.to_score_report()
-                              for game in highScores])
+        user_names = get_user_names(highScores)
+        return GameHighScores(
+            high_scores=[game.to_score_report(user_names)
+                         for game in highScores],
+            next_cursor=next_cursor)
 
-    @endpoints.method(response_message=Rankings,
+    @endpoints.method(request_message=RANKINGS_REQUEST,
+                      response_message=Rankings,
                       path='users/rankings',
                       name='get_user_rankings',
                       http_method='GET')
     def get_user_rankings(self, request):
-        """Return all users' high scores in descending order."""
-        userRankings = User.query(
-            User.points_earned > 0).order(-User.points_earned)
+        """Return a page of users' high scores in descending order."""
+        offset = max(request.offset or 0, 0)
+        limit = check_page_size(leaderboard.LEADERBOARD_SIZE
+                                if request.limit is None else request.limit)
+        userRankings = leaderboard.get_rankings(offset, limit)
         if not userRankings:
             raise endpoints.NotFoundException('Rankings not found.')
-        return Rankings(rankings=[user.to_ranking() for user in userRankings])
+        return Rankings(rankings=[
+            RankingForm(rank=rank, name=name, points_earned=points)
+            for rank, name, points in userRankings])
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=RankingForm,
+                      path='users/rank/{user_name}',
+                      name='get_user_rank',
+                      http_method='GET')
+    def get_user_rank(self, request):
+        """Return an individual User's rank by points earned."""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                'A User with that name does not exist!')
+        return user.to_ranking(leaderboard.get_rank(user))
 
-    @endpoints.method(response_message=Analysis,
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=UserStatsForm,
+                      path='users/stats/{user_name}',
+                      name='get_user_stats',
+                      http_method='GET')
+    def get_user_stats(self, request):
+        """Return an individual User's game totals."""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                'A User with that name does not exist!')
+        return user.to_stats_form()
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=Analysis,
                       path='games/analysis',
                       name='get_game_analysis',
                       http_method='GET')
     def get_game_analysis(self, request):
-        """Return history of in-game choices."""
-        games = Game.query().order(Game.user)
+        """Return a page of the history of in-game choices."""
+        games, next_cursor = fetch_page(Game.query().order(Game.user),
+                                        request.page_size,
+                                        request.cursor)
         if not games:
             raise endpoints.NotFoundException('Games not found.')
-        return Analysis(analysis=[game.to_game_analysis() for game in games])
+        user_names = get_user_names(games)
+        return Analysis(analysis=[game.to_game_analysis(user_names)
+                        for game in games],
+                        next_cursor=next_cursor)
+
+    @endpoints.method(request_message=ROLLUPS_REQUEST,
+                      response_message=GameRollupForms,
+                      path='games/rollups',
+                      name='get_game_rollups',
+                      http_method='GET')
+    def get_game_rollups(self, request):
+        """Return win rate and average points by in-game choices, or for
+        one User if user_name is given."""
+        if request.user_name:
+            user = User.get_by_name(request.user_name)
+            if not user:
+                raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+            rollup = GameRollup.user_key(user.key).get()
+            rollups = [rollup.to_form(user.name)] if rollup else []
+        else:
+            rollups = [rollup.to_form()
+                       for rollup in GameRollup.get_choice_rollups()]
+        return GameRollupForms(rollups=rollups)
 
     @staticmethod
     def _cache_average_game_points():
-        """Populates memcache with average points won per game."""
-        games = Game.query(Game.status == 'WON').fetch()
-        if games:
-            count = len(games)
-            total_points = sum([game.points for game in games])
-            average = float(total_points) / count
-            memcache.set(MEMCACHE_AVE_PTS_PER_GAME,
-                         'Ave pts won per game is {:.2f}'.format(average))
+        """Returns the average points won per game, computing it from the
+        points shards if the cached response is missing or outdated."""
+        def build():
+            average = GamePointsShard.get_average()
+            if average is None:
+                return StringMessage(
+                    message='Average points are not available.')
+            return StringMessage(
+                message='Ave pts won per game is {:.2f}'.format(average))
+        return response_cache.read_through(
+            'get_average_game_points', None, [response_cache.SCORES_SCOPE],
+            StringMessage, build)
+
 
+refresh.register(AVERAGE_GAME_POINTS_REFRESH,
+                 AVERAGE_GAME_POINTS_REFRESH_INTERVAL,
+                 WhoSaysApi._cache_average_game_points)
 
-APPLICATION = endpoints.api_server([WhoSaysApi])
+APPLICATION = instrumentation.wrap(endpoints.api_server([WhoSaysApi]))